@@ -0,0 +1,112 @@
+import asyncio
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from harness import FlvSink, make_clip
+from harness.telegram import FakeClient, FakeMessage, FakeCallbackQuery, local_open_telegram
+from player import Player, StageTimer
+
+logging.basicConfig(format='%(asctime)s [%(levelname).1s] [%(name)s] %(message)s', level=logging.WARNING)
+
+STAGES = ["probe", "open", "flush", "first keyframe", "first mux", "ingest"]
+
+
+def prepare(root, lives, clip_length):
+    """Create the local video files, config.json and live_info.json used by bot_main"""
+    clip = make_clip(os.path.join(root, 'clip.mp4'), clip_length)
+    for name in lives:
+        base_dir = os.path.join(root, 'lives', name, 'transcoded')
+        os.makedirs(base_dir)
+        shutil.copy(clip, os.path.join(base_dir, 'hq.mp4'))
+        with open(os.path.join(base_dir, 'danmaku.json'), 'w', encoding='utf8') as f:
+            json.dump({'data': [[t, 0, 0, '', f"弹幕 {t}"] for t in range(int(clip_length))]}, f)
+    config = {
+        'api_id': 1, 'api_hash': '0' * 32,
+        'bot': [{'name': 'bench_bot0', 'token': '0:bench'}, {'name': 'bench_bot1', 'token': '1:bench'}],
+        'user': [{'chat_id': 1}, {'chat_id': 2, 'phone_number': '+0'}],
+        'test_group': {'chat_id': -1},
+        'test_channel': {'chat_id': -1000000000002, 'message_id': {'danmaku': 1}},
+        'danmaku': {'total_count': 20, 'update_interval': 3, 'update_count': 5},
+    }
+    with open(os.path.join(root, 'config.json'), 'w') as f:
+        json.dump(config, f)
+    with open(os.path.join(root, 'live_info.json'), 'w', encoding='utf8') as f:
+        json.dump({'2022': {'01': lives}}, f, ensure_ascii=False)
+
+
+async def run_once(bot_main, sink: FlvSink, handler, timeout=10.):
+    timer = bot_main.player.timeline = StageTimer()
+    handler_task = asyncio.create_task(handler())
+    try:
+        async with asyncio.timeout(timeout):
+            while "first mux" not in timer.stages:
+                await asyncio.sleep(0.002)
+            switch_time = bot_main.player._packet_modifier.switch_time
+            # FLV timestamps are in milliseconds
+            while not any(r.keyframe and abs(r.timestamp - switch_time) < 0.002 for r in reversed(sink.records)):
+                await asyncio.sleep(0.002)
+            timer.mark("ingest")
+            await handler_task
+    finally:
+        bot_main.player.timeline = None
+    return timer
+
+
+async def main(args):
+    repo_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        lives = [f"2022010{i + 1} bench live {i + 1}" for i in range(2)]
+        await asyncio.to_thread(prepare, root, lives, args.clip_length)
+        os.chdir(root)  # bot_main and selector read config.json and live_info.json from the working directory
+        try:
+            import bot_main
+            import selector
+            fake = FakeClient(rtt=args.rtt)
+            bot_main.bots, bot_main.bot0, bot_main.user = [fake, fake], fake, fake
+            bot_main.cli_args = SimpleNamespace(prefix="tg:///lives")
+            bot_main.open_telegram = local_open_telegram(root)
+            results = await bench(args, bot_main, selector, fake, lives)
+        finally:
+            os.chdir(repo_dir)
+    print(f"\n{'stage':<16}{'median':>10}{'max':>10}")
+    for stage in [*STAGES, 'total']:
+        values = [sum(timer.stages.values()) if stage == 'total' else timer.stages[stage] for timer in results]
+        print(f"{stage:<16}{statistics.median(values) * 1000:>8.1f}ms{max(values) * 1000:>8.1f}ms")
+
+
+async def bench(args, bot_main, selector, fake, lives):
+    with FlvSink() as sink:
+        bot_main.player = await Player.create(sink.url)
+        await bot_main.play_live(lives[0])  # warm up, the first play does not flush anything
+        results = []
+        for i in range(args.runs):
+            await asyncio.sleep(args.interval)
+            target = (i + 1) % 2  # switch between the two lives
+            if i % 2:
+                handler = lambda: bot_main.sel_update(
+                    None, FakeCallbackQuery(fake, selector.sel_date_regex, f'SEL_Y_2022_M_01_N_0{target + 1}'))
+            else:
+                handler = lambda: bot_main.play_live(lives[target], FakeMessage(fake))
+            start = time.perf_counter()
+            timer = await run_once(bot_main, sink, handler)
+            results.append(timer)
+            print(f"run {i + 1} ({'sel_update' if i % 2 else 'play_live'}): {timer}, "
+                  f"handler returned after {time.perf_counter() - start:.3f}s")
+        bot_main.player.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmark /play latency with a fake Telegram client")
+    parser.add_argument('-n', '--runs', type=int, default=6)
+    parser.add_argument('--rtt', type=float, default=0.05, help="emulated Telegram round trip in seconds")
+    parser.add_argument('--interval', type=float, default=2., help="seconds between two switches")
+    parser.add_argument('--clip-length', type=float, default=20.)
+    asyncio.run(main(parser.parse_args()))
@@ -1,47 +1,128 @@
+from dataclasses import dataclass
 import logging
 import random
 from typing import Union, Optional, Generator
+import weakref
 
+from pyrogram.errors import GroupCallInvalid
 from pyrogram.raw import functions, types
 from pyrogram import Client
 
 
+@dataclass
+class CallState:
+    """
+    What is known about the group call of a chat, so that each operation does not start from scratch.
+    It is updated by the `UpdateGroupCall` in the results of the calls made here,
+    and the call is looked up again when Telegram says it is invalid.
+    Only an active call is cached. The user client receives no updates, so a call started from the app
+    would never be seen if "no active call" were cached as well.
+    """
+    peer: Optional[types.InputPeerChannel] = None
+    call: Optional[types.InputGroupCall] = None
+    title: Optional[str] = None
+    rtmp_url: Optional[str] = None
+
+    def invalidate_call(self):
+        self.call = self.title = None
+
+
+_states: weakref.WeakKeyDictionary[Client, dict[Union[int, str], CallState]] = weakref.WeakKeyDictionary()
+
+
+def get_call_state(client: Client, chat_id: Union[int, str]) -> CallState:
+    return _states.setdefault(client, {}).setdefault(chat_id, CallState())
+
+
+def _apply_updates(client: Client, updates: types.Updates):
+    """Update the cached calls from the result of a call"""
+    for update in [updates.update] if isinstance(updates, types.UpdateShort) else updates.updates:
+        if not isinstance(update, types.UpdateGroupCall):
+            continue
+        for state in _states.get(client, {}).values():
+            if state.peer is None or state.peer.channel_id != update.chat_id:
+                continue
+            if isinstance(update.call, types.GroupCall):
+                state.call = types.InputGroupCall(id=update.call.id, access_hash=update.call.access_hash)
+                state.title = update.call.title
+            else:  # GroupCallDiscarded
+                state.invalidate_call()
+
+
+async def _resolve_peer(client: Client, chat_id: Union[int, str]) -> types.InputPeerChannel:
+    state = get_call_state(client, chat_id)
+    if state.peer is None:
+        state.peer = await client.resolve_peer(chat_id)
+    return state.peer
+
+
 # from pyrogram.raw.functions
-async def get_group_call(client: Client, chat_id: Union[int, str]) -> Optional[types.InputGroupCall]:
-    channel = await client.resolve_peer(chat_id)
+async def get_group_call(client: Client, chat_id: Union[int, str], cached=True) -> Optional[types.InputGroupCall]:
+    state = get_call_state(client, chat_id)
+    if cached and state.call is not None:
+        return state.call
+    channel = await _resolve_peer(client, chat_id)
     full_chat = await client.invoke(functions.channels.GetFullChannel(channel=channel))
     assert isinstance(full_chat, types.messages.ChatFull)
-    return full_chat.full_chat.call
+    if (call := full_chat.full_chat.call) != state.call:
+        state.title = None
+    state.call = call
+    return call
 
 
 async def edit_group_call_title(client: Client, chat_id: Union[int, str], title: str) -> types.GroupCall:
-    call = await get_group_call(client, chat_id)
-    if call is None:
-        raise ValueError(f"chat does not have an active group call")
-    r = await client.invoke(functions.phone.EditGroupCallTitle(call=call, title=title))
-    for i in r.updates:
-        if isinstance(i, types.UpdateGroupCall):
-            return i.call
+    for cached in (True, False):
+        call = await get_group_call(client, chat_id, cached)
+        if call is None:
+            raise ValueError(f"chat does not have an active group call")
+        try:
+            r = await client.invoke(functions.phone.EditGroupCallTitle(call=call, title=title))
+        except GroupCallInvalid:
+            if not cached:
+                raise
+            logging.info(f"the cached group call of {chat_id} is invalid, looking it up again")
+            get_call_state(client, chat_id).invalidate_call()
+            continue
+        _apply_updates(client, r)
+        for i in r.updates:
+            if isinstance(i, types.UpdateGroupCall):
+                return i.call
 
 
 async def restart_group_call(client: Client, chat_id: Union[int, str]):
-    call = await get_group_call(client, chat_id)
+    state = get_call_state(client, chat_id)
     old_title = None
     update_message_ids = []
     # discard existing call and remember the old title
-    if call is not None:
-        call_info: types.phone.GroupCall
-        call_info = await client.invoke(functions.phone.GetGroupCall(call=call, limit=100))
-        old_title = call_info.call.title
-        discard = await client.invoke(functions.phone.DiscardGroupCall(call=call))
+    for cached in (True, False):
+        call = await get_group_call(client, chat_id, cached)
+        if call is None:
+            break
+        try:
+            if state.title is None:
+                call_info: types.phone.GroupCall
+                call_info = await client.invoke(functions.phone.GetGroupCall(call=call, limit=100))
+                state.title = call_info.call.title
+            old_title = state.title
+            discard = await client.invoke(functions.phone.DiscardGroupCall(call=call))
+        except GroupCallInvalid:
+            if not cached:
+                raise
+            logging.info(f"the cached group call of {chat_id} is invalid, looking it up again")
+            state.invalidate_call()
+            continue
         update_message_ids += get_message_id_from_updates(discard)
+        break
+    state.invalidate_call()
+    state.rtmp_url = None
     # create a new call with the old title or empty title
     create = await client.invoke(functions.phone.CreateGroupCall(
-        peer=await client.resolve_peer(chat_id),
+        peer=await _resolve_peer(client, chat_id),
         random_id=random.randint(-1 << 31, (1 << 31) - 1),  # note: Int(random_id) is a signed 32-bit LE integer
         rtmp_stream=True,
         title=old_title
     ))
+    _apply_updates(client, create)
     update_message_ids += get_message_id_from_updates(create)
     # delete the messages saying "xxx started a video chat" and "xxx ended the video chat (xxx time)"
     logging.info(f"deleting update messages {update_message_ids} when restarting group call")
@@ -49,10 +130,13 @@ async def restart_group_call(client: Client, chat_id: Union[int, str]):
 
 
 async def get_rtmp_url(client: Client, chat_id: Union[int, str]) -> str:
-    channel = await client.resolve_peer(chat_id)
-    rtmp_url: types.phone.GroupCallStreamRtmpUrl
-    rtmp_url = await client.invoke(functions.phone.GetGroupCallStreamRtmpUrl(peer=channel, revoke=False))
-    return rtmp_url.url + rtmp_url.key
+    state = get_call_state(client, chat_id)
+    if state.rtmp_url is None:
+        channel = await _resolve_peer(client, chat_id)
+        rtmp_url: types.phone.GroupCallStreamRtmpUrl
+        rtmp_url = await client.invoke(functions.phone.GetGroupCallStreamRtmpUrl(peer=channel, revoke=False))
+        state.rtmp_url = rtmp_url.url + rtmp_url.key
+    return state.rtmp_url
 
 
 def get_message_id_from_updates(updates: types.Updates) -> Generator[int, None, None]:
@@ -4,6 +4,19 @@ from pyrogram.enums import ParseMode
 from pyrogram.errors import FloodWait
 import asyncio
 
+
+async def _edit(client: Client, chat_id, message_id, text: str):
+    try:
+        await client.edit_message_text(
+            chat_id, message_id, text,
+            parse_mode=ParseMode.DISABLED,
+            disable_web_page_preview=True
+        )
+    except FloodWait as e:
+        logging.error(f"client '{client.name}' got FloodWait for {e.value} seconds")
+        # await asyncio.sleep(e.value)
+
+
 def polling(clients: list[Client], chat_id, message_id):
     def _gen_func():
         if clients:
@@ -11,16 +24,24 @@ def polling(clients: list[Client], chat_id, message_id):
                 yield from clients
 
     async def edit(text: str):
-        client = next(clients_iter)
-        try:
-            await client.edit_message_text(
-                chat_id, message_id, text,
-                parse_mode=ParseMode.DISABLED,
-                disable_web_page_preview=True
-            )
-        except FloodWait as e:
-            logging.error(f"client '{client.name}' got FloodWait for {e.value} seconds")
-            # await asyncio.sleep(e.value)
+        await _edit(next(clients_iter), chat_id, message_id, text)
 
     clients_iter = _gen_func()
     return edit
+
+
+def sharded(clients: list[Client], chat_id, message_ids: list[int]):
+    """
+    One edit callback for each message, the i-th message is always edited by the (i mod N)-th client,
+    so the edit rate limit of each bot is shared by as few messages as possible
+    """
+    if len(message_ids) > len(clients):
+        logging.warning(f"{len(message_ids)} danmaku messages are edited by only {len(clients)} bots")
+
+    def edit_func(client, message_id):
+        async def edit(text: str):
+            await _edit(client, chat_id, message_id, text)
+
+        return edit
+
+    return [edit_func(clients[i % len(clients)], message_id) for i, message_id in enumerate(message_ids)]
@@ -1,26 +1,45 @@
+import time
+
+_boot_time = time.perf_counter()
+
 import asyncio
 import argparse
 import contextlib
 import functools
+import io
 import json
 import logging
+from typing import Optional
 
 from pyrogram import Client, filters, idle
 from pyrogram.types import Message, CallbackQuery
 from pyrogram.enums import ParseMode
-import asrec_telegram
-from asrec_telegram import open_telegram
 
 from bot_lib import update_message, app_group, edit_group_call_title, get_rtmp_url, restart_group_call
-from player import Player, Progress, Danmaku
+from control import ControlServer, ControlError
+from player import Player, Progress, Danmaku, StageTimer
+from player.catalog import Catalog
+from player.logs import setup_logging, raise_verbosity, SUBSYSTEMS
+import profiler
 import selector
 
-logging.basicConfig(format='%(asctime)s [%(levelname).1s] [%(name)s] %(message)s', level=logging.INFO)
+setup_logging()  # written by a background thread, never blocking the event loop
 logging.getLogger('pyrogram').setLevel(logging.WARNING)
 
 with open("config.json") as conf_f:
     config = json.load(conf_f)
 
+# production profile by default, set {"debug": true} to get asyncio debug mode and slow callback warnings
+loop_profile = config.get('event_loop', {})
+if loop_profile.get('uvloop'):
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning("uvloop is not installed, using the default event loop")
+    else:
+        # must be set before creating the clients, they bind the event loop at initialization
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
 bots = [Client(bot_i['name'], api_id=config['api_id'], api_hash=config['api_hash'],
                bot_token=bot_i['token'], parse_mode=ParseMode.DISABLED, max_concurrent_transmissions=2)
         for bot_i in config['bot']]
@@ -28,17 +47,55 @@ bot0 = bots[0]
 user = Client('user1', api_id=config['api_id'], api_hash=config['api_hash'],
               phone_number=config['user'][1]["phone_number"], no_updates=True)
 
+control_config = config.get('control')
+control = ControlServer(token=control_config.get('token')) if control_config else None
+catalog: Optional[Catalog] = None
+now_playing: Optional[str] = None
+preloaded_name: Optional[str] = None
+
 filter_me = filters.user([user_i['chat_id'] for user_i in config['user']]) & filters.private
 filter_my_group_or_me = filters.chat(config['test_group']['chat_id']) | filter_me
 
 
-async def init():
-    global player, version
-    connect_database = str(cli_args.prefix).startswith('tg://')
-    db_context = asrec_telegram.database.connect() if connect_database else contextlib.nullcontext()
-    async with app_group([*bots]), user, db_context:
-        await bot0.send_message(config['test_group']['chat_id'], f"机器人已启动 [{version}]")
-        player = Player(await get_rtmp_url(user, config['test_channel']['chat_id']))
+def open_telegram(*args, **kwargs):
+    from asrec_telegram import open_telegram as _open_telegram  # only needed with a tg:// prefix
+    return _open_telegram(*args, **kwargs)
+
+
+async def init(timer: StageTimer):
+    global player, version, catalog
+    catalog = selector.catalog = None if cli_args.catalog is None else Catalog(cli_args.catalog)
+
+    async def start_bots():
+        with timer.stage("start bots"):
+            await stack.enter_async_context(app_group([*bots]))
+        with timer.stage("startup message"):
+            await bot0.send_message(config['test_group']['chat_id'], f"机器人已启动 [{version}]")
+
+    async def start_player():
+        with timer.stage("start user"):
+            await stack.enter_async_context(user)
+        with timer.stage("get rtmp url"):
+            rtmp_url = await get_rtmp_url(user, config['test_channel']['chat_id'])
+        with timer.stage("open output"):
+            return await Player.create(rtmp_url, shaping=config.get('shaping'), isolation=config.get('isolation'),
+                                       cache=config.get('cache'))
+
+    async with contextlib.AsyncExitStack() as stack:
+        if str(cli_args.prefix).startswith('tg://'):
+            with timer.stage("connect database"):
+                import asrec_telegram
+                await stack.enter_async_context(asrec_telegram.database.connect())
+        # independent steps run concurrently
+        async with asyncio.TaskGroup() as group:
+            group.create_task(start_bots())
+            player_task = group.create_task(start_player())
+        player = player_task.result()
+        if control is not None:
+            with timer.stage("start control API"):
+                await control.start(**{k: v for k, v in control_config.items() if k in ('host', 'port', 'path')})
+                stack.push_async_callback(control.close)
+        logging.info(f"startup finished: {timer}")
         await idle()
 
 
@@ -50,6 +107,8 @@ async def help_command(_, message):
         `/play video_name` - All available `video_name`s are in the group file;
         `/select` - select a live from the menu;
         `/restart` - restart telegram group call (continue playing the current video);
+        `/profile [seconds]` - profile the running bot, default 10 seconds;
+        `/verbose subsystem [seconds] [level]` - log a subsystem in detail for a while, default 60 seconds of DEBUG;
         """
     )
 
@@ -73,8 +132,62 @@ async def sel_command(_, message: Message):
 
 @bot0.on_message(filters.command("restart") & filter_my_group_or_me)
 async def restart_command(_, message):
-    await restart_group_call(user, config['test_channel']['chat_id'])
-    await message.reply("频道直播已重置")
+    timer = StageTimer()
+    try:
+        await restart_live(timer)
+    except Exception as e:
+        if "get rtmp url" not in timer.stages:  # the group call is not restarted
+            raise
+        logging.error(f"failed to switch the output after restarting the group call: {e!r}")
+        await message.reply(f"频道直播已重置，但切换推流失败 ({timer})")
+        return
+    await message.reply(f"频道直播已重置 ({timer})")
+
+
+async def restart_live(timer: StageTimer):
+    """Recreate the group call and switch the output to its new RTMP URL"""
+    chat_id = config['test_channel']['chat_id']
+    # the old output breaks once the call is discarded, keep the muxer from reconnecting it meanwhile
+    with player.output_switch_pending():
+        await restart_group_call(user, chat_id)
+        timer.mark("recreate call")
+        rtmp_url = await get_rtmp_url(user, chat_id)
+        timer.mark("get rtmp url")
+        await player.switch_output(rtmp_url, timer=timer)
+    logging.info(f"group call restarted: {timer}")
+
+
+@bot0.on_message(filters.command("profile") & filter_me)
+async def profile_command(_, message: Message):
+    try:
+        duration = float(message.command[1]) if len(message.command) > 1 else 10.
+    except ValueError:
+        await message.reply("Usage: `/profile [seconds]`")
+        return
+    duration = min(max(duration, 1.), 300.)
+    reply = await message.reply(f"正在采样 {duration:.0f}s ...")
+    try:
+        result = await profiler.profile(duration, **config.get('profiler', {}))
+    except RuntimeError:
+        await reply.edit_text("已有正在进行的采样")
+        return
+    await reply.edit_text(result.report()[:4096])
+    raw_file = io.BytesIO(result.collapsed().encode('utf-8'))
+    raw_file.name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+    await message.reply_document(raw_file, caption="原始采样数据 (collapsed stack 格式，可用 speedscope 打开)")
+
+
+@bot0.on_message(filters.command("verbose") & filter_me)
+async def verbose_command(_, message: Message):
+    args = message.command[1:]
+    try:
+        duration = min(max(float(args[1]), 1.), 3600.) if len(args) > 1 else 60.
+        raise_verbosity(args[0], args[2] if len(args) > 2 else logging.DEBUG, duration)
+    except (IndexError, ValueError) as e:
+        await message.reply(f"Usage: `/verbose subsystem [seconds] [level]`\n"
+                            f"subsystem: {', '.join(SUBSYSTEMS)}\n{e if isinstance(e, ValueError) else ''}")
+        return
+    await message.reply(f"{args[0]} 的日志级别已调整 {duration:.0f}s")
 
 
 @bot0.on_callback_query(filters.regex(selector.sel_date_regex))
@@ -99,37 +212,61 @@ async def report_error(_, callback_query: CallbackQuery):
     await callback_query.message.edit_text("failed")
 
 
-async def play_live(name: str, reply_message: Message = None):
+def start_live(name: str, progress_aiter: Progress = None, *, start=0., preload=False):
+    """Hand the video and danmaku of a live to the player, shared by the Telegram commands and the control API"""
+    global preloaded_name
+
+    def on_start():
+        global now_playing
+        now_playing = name
+
     channel_ids = config['test_channel']
-    edit_callable = update_message.polling(bots, channel_ids['chat_id'], channel_ids['message_id']['danmaku'])
+    message_ids = channel_ids['message_id']['danmaku']
+    if isinstance(message_ids, list):  # sharded across several messages and bots
+        edit_callable = update_message.sharded(bots, channel_ids['chat_id'], message_ids)
+    else:
+        edit_callable = update_message.polling(bots, channel_ids['chat_id'], message_ids)
     base_dir = f'{cli_args.prefix}/{name}/transcoded'
     video_path = f'{base_dir}/hq.mp4'
     if video_path.startswith('tg://'):
         video_path = functools.partial(open_telegram, bot0, video_path[6:])
+    danmaku_path = f'{base_dir}/danmaku.json'
+    if danmaku_path.startswith('tg://'):
+        dm_app = bots[1] if len(bots) > 1 else bot0
+        danmaku_path = functools.partial(open_telegram, dm_app, danmaku_path[6:])
+    player.play_now(
+        video_path,
+        progress_aiter=progress_aiter,
+        start=start,
+        preload=preload,
+        media_info=None if catalog is None else catalog.get(name),
+        danmaku=Danmaku(
+            danmaku_path, edit_callable,
+            total_count=config['danmaku']['total_count'],
+            update_interval=config['danmaku']['update_interval'],
+            update_count=config['danmaku']['update_count'],
+        ),
+        on_start=on_start,
+    )
+    # a new request always replaces the pending preload, which is reported while the player still has it
+    preloaded_name = name if preload else None
+
+
+async def update_title(name: str):
+    try:
+        await edit_group_call_title(user, config['test_channel']['chat_id'], name[9:])
+    except Exception as e:
+        logging.error(f"got exception \"{e!r}\" when editing the call title, ignored")
+
 
+async def play_live(name: str, reply_message: Message = None):
     progress_aiter = None if reply_message is None else Progress()
     try:
-        danmaku_path = f'{base_dir}/danmaku.json'
-        if danmaku_path.startswith('tg://'):
-            dm_app = bots[1] if len(bots) > 1 else bot0
-            danmaku_path = functools.partial(open_telegram, dm_app, danmaku_path[6:])
-        player.play_now(
-            video_path,
-            progress_aiter=progress_aiter,
-            danmaku=Danmaku(
-                danmaku_path, edit_callable,
-                total_count=config['danmaku']['total_count'],
-                update_interval=config['danmaku']['update_interval'],
-                update_count=config['danmaku']['update_count'],
-            )
-        )
+        start_live(name, progress_aiter)
         if reply_message is not None:
             async for pg in progress_aiter:
                 await reply_message.edit_text(pg)
-        try:
-            await edit_group_call_title(user, channel_ids['chat_id'], name[9:])
-        except Exception as e:
-            logging.error(f"got exception \"{e!r}\" when editing the call title, ignored")
+        await update_title(name)
         logging.info(f"Finish starting procedure of {name}")
     except RuntimeError:
         if reply_message is not None:
@@ -138,13 +275,112 @@ async def play_live(name: str, reply_message: Message = None):
         raise
 
 
+async def progress_events(progress_aiter: Progress, name: str):
+    async for message in progress_aiter:
+        yield {'event': 'progress', 'name': name, 'message': message}
+    yield {'event': 'finished', 'name': name}
+
+
+def start_live_api(name: str, **kwargs):
+    progress_aiter = Progress()
+    try:
+        start_live(name, progress_aiter, **kwargs)
+    except RuntimeError as e:
+        raise ControlError(503, str(e))
+    if not kwargs.get('preload'):
+        asyncio.create_task(update_title(name))
+    return progress_events(progress_aiter, name)
+
+
+if control is not None:
+    @control.route('GET', '/status')
+    async def status_api(_):
+        status = player.status()
+        return {'name': now_playing, 'preloaded': preloaded_name if status['preload_pending'] else None, **status}
+
+
+    @control.route('GET', '/buffer')
+    async def buffer_api(_):
+        return player.buffer_state()
+
+
+    @control.route('POST', '/play')
+    async def play_api(request):
+        if not (name := request.param('name')):
+            raise ControlError(400, "name is required")
+        return start_live_api(name, start=request.param('start', 0., float))
+
+
+    @control.route('POST', '/preload')
+    async def preload_api(request):
+        if not (name := request.param('name')):
+            raise ControlError(400, "name is required")
+        return start_live_api(name, start=request.param('start', 0., float), preload=True)
+
+
+    @control.route('POST', '/preload/play')
+    async def play_preloaded_api(_):
+        if not player.play_preloaded():
+            raise ControlError(409, "nothing is preloaded")
+        # now_playing is set by the start callback once the player switches
+        asyncio.create_task(update_title(preloaded_name))
+        return {'name': preloaded_name}
+
+
+    @control.route('POST', '/seek')
+    async def seek_api(request):
+        if now_playing is None:
+            raise ControlError(409, "nothing is playing")
+        if (time_ := request.param('time', type_=float)) is None:
+            raise ControlError(400, "time is required")
+        return start_live_api(now_playing, start=time_)
+
+
+    @control.route('POST', '/restart')
+    async def restart_api(_):
+        timer = StageTimer()
+        try:
+            await restart_live(timer)
+        except Exception as e:
+            logging.error(f"failed to restart the group call from the control API: {e!r}")
+            raise ControlError(500, f"restart failed after {timer}: {e!r}")
+        return {'stages': timer.stages}
+
+
+    @control.route('POST', '/profile')
+    async def profile_api(request):
+        duration = min(max(request.param('seconds', 10., float), 1.), 300.)
+        try:
+            result = await profiler.profile(duration, **config.get('profiler', {}))
+        except RuntimeError as e:
+            raise ControlError(409, str(e))
+        return {'report': result.report(), 'collapsed': result.collapsed()}
+
+
+    @control.route('POST', '/verbose')
+    async def verbose_api(request):
+        if not (name := request.param('name')):
+            raise ControlError(400, "name is required")
+        duration = min(max(request.param('seconds', 60., float), 1.), 3600.)
+        try:
+            raise_verbosity(name, request.param('level', 'DEBUG'), duration)
+        except ValueError as e:
+            raise ControlError(400, str(e))
+        return {'name': name, 'seconds': duration}
+
+
 if __name__ == '__main__':
     version = "v250831"
     logging.info(f"starting aslive bot {version}")
     parser = argparse.ArgumentParser(
         description=f"stream h264 mp4 A-SOUL record video to telegram livestream [{version}]")
     parser.add_argument('-p', '--prefix', help="base location of the video files")
+    parser.add_argument('-c', '--catalog', help="media catalog database built by build_catalog.py")
     cli_args = parser.parse_args()
+    boot_timer = StageTimer(start_time=_boot_time)
+    boot_timer.mark("import")
     loop = asyncio.get_event_loop()
-    loop.set_debug(True)
-    run = loop.run_until_complete(init())
+    loop.set_debug(loop_profile.get('debug', False))
+    if 'slow_callback_duration' in loop_profile:
+        loop.slow_callback_duration = loop_profile['slow_callback_duration']
+    run = loop.run_until_complete(init(boot_timer))
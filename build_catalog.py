@@ -0,0 +1,26 @@
+import argparse
+import logging
+
+from player.catalog import Catalog, build_catalog
+import selector
+
+logging.basicConfig(format='%(asctime)s [%(levelname).1s] [%(name)s] %(message)s', level=logging.INFO)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="probe all videos in live_info.json into the media catalog")
+    parser.add_argument('-p', '--prefix', required=True, help="base location of the video files")
+    parser.add_argument('-c', '--catalog', default='catalog.db', help="the catalog database")
+    parser.add_argument('-j', '--workers', type=int, help="number of probing processes")
+    parser.add_argument('--refresh', action='store_true', help="probe the files again even if they are not changed")
+    args = parser.parse_args()
+    if args.prefix.startswith('tg://'):
+        parser.error("files on Telegram cannot be probed, use a local or HTTP prefix")
+    paths = {
+        name: f'{args.prefix}/{name}/transcoded/hq.mp4'
+        for months in selector.get_live_info().values() for names in months.values() for name in names
+    }
+    catalog = Catalog(args.catalog)
+    try:
+        build_catalog(catalog, paths, args.workers, args.refresh)
+    finally:
+        catalog.close()
@@ -0,0 +1,191 @@
+"""
+Local control API, a minimal HTTP/1.1 server on a TCP port or a Unix socket.
+
+- Routes are registered with the `ControlServer.route` decorator.
+- Request bodies and responses are JSON. A handler returning an async iterator is streamed
+  as NDJSON (one JSON object per line) with chunked transfer encoding, e.g. for progress events.
+- Connections are kept alive, so polling a status endpoint costs one small read and write.
+"""
+import asyncio
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Optional, Union, AsyncIterator
+from urllib import parse
+
+_reasons = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed',
+            409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+MAX_BODY_SIZE = 1 << 20
+
+
+class ControlError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: dict[str, str]
+    headers: dict[str, str]
+    body: Any = field(default=None)  # parsed JSON
+
+    def param(self, name, default=None, type_=None):
+        """Read a parameter from the JSON body or the query string"""
+        value = self.body.get(name) if isinstance(self.body, dict) else None
+        if value is None:
+            value = self.query.get(name, default)
+        if value is None or type_ is None:
+            return value
+        try:
+            return type_(value)
+        except (TypeError, ValueError):
+            raise ControlError(400, f"invalid parameter {name}: {value!r}")
+
+
+Handler = Callable[[Request], Awaitable[Union[dict, list, AsyncIterator[dict], None]]]
+
+
+class ControlServer:
+    _routes: dict[tuple[str, str], Handler]
+    _server: Optional[asyncio.AbstractServer] = None
+
+    def __init__(self, token: str = None):
+        """
+        :param token: if set, requests must have the header ``Authorization: Bearer <token>``
+        """
+        self.token = token
+        self._routes = {}
+
+    def route(self, method: str, path: str):
+        def decorator(handler: Handler):
+            self._routes[(method.upper(), path)] = handler
+            return handler
+
+        return decorator
+
+    async def start(self, host='127.0.0.1', port: int = None, path: str = None):
+        """Listen on the Unix socket `path` if it is given, otherwise on `host`:`port`"""
+        if path is not None:
+            if os.path.exists(path):
+                os.unlink(path)
+            self._server = await asyncio.start_unix_server(self._handle_connection, path)
+            os.chmod(path, 0o600)
+            logging.info(f"control API is listening on {path}")
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, host, port)
+            host, port = self._server.sockets[0].getsockname()[:2]
+            logging.info(f"control API is listening on http://{host}:{port}")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while (request := await self._read_request(reader, writer)) is not None:
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                await self._dispatch(request, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"control API connection failed: {e!r}")
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer) -> Optional[Request]:
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            await self._respond(writer, 400, {'error': 'malformed request line'}, keep_alive=False)
+            return None
+        headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length') or 0)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            await self._respond(writer, 400, {'error': 'invalid Content-Length'}, keep_alive=False)
+            return None
+        if length > MAX_BODY_SIZE:
+            await self._respond(writer, 413, {'error': 'request body is too large'}, keep_alive=False)
+            return None
+        body = None
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except ValueError:
+                await self._respond(writer, 400, {'error': 'request body is not JSON'}, keep_alive=False)
+                return None
+        url = parse.urlsplit(target)
+        return Request(method.upper(), url.path, dict(parse.parse_qsl(url.query)), headers, body)
+
+    async def _dispatch(self, request: Request, writer, keep_alive):
+        handler = self._routes.get((request.method, request.path))
+        try:
+            if self.token is not None and request.headers.get('authorization') != f'Bearer {self.token}':
+                raise ControlError(401, "invalid token")
+            if handler is None:
+                if any(path == request.path for _, path in self._routes):
+                    raise ControlError(405, f"{request.method} is not allowed on {request.path}")
+                raise ControlError(404, f"no such endpoint: {request.path}")
+            result = await handler(request)
+        except ControlError as e:
+            await self._respond(writer, e.status, {'error': e.message}, keep_alive)
+            return
+        except Exception as e:
+            logging.error(f"control API {request.method} {request.path} failed: {e!r}")
+            await self._respond(writer, 500, {'error': repr(e)}, keep_alive)
+            return
+        logging.debug(f"control API {request.method} {request.path}")
+        if hasattr(result, '__aiter__'):
+            await self._stream(writer, result, keep_alive)
+        else:
+            await self._respond(writer, 200, {} if result is None else result, keep_alive)
+
+    @staticmethod
+    def _head(status, content_type, keep_alive, extra=''):
+        return (f"HTTP/1.1 {status} {_reasons.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n{extra}\r\n").encode('latin-1')
+
+    async def _respond(self, writer: asyncio.StreamWriter, status, data, keep_alive):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        writer.write(self._head(status, 'application/json', keep_alive, f"Content-Length: {len(body)}\r\n") + body)
+        await writer.drain()
+
+    async def _stream(self, writer: asyncio.StreamWriter, events: AsyncIterator[dict], keep_alive):
+        writer.write(self._head(200, 'application/x-ndjson', keep_alive, "Transfer-Encoding: chunked\r\n"))
+        try:
+            async for event in events:
+                line = json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n'
+                writer.write(b'%x\r\n%s\r\n' % (len(line), line))
+                await writer.drain()
+        finally:
+            if hasattr(events, 'aclose'):
+                await events.aclose()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
@@ -0,0 +1,3 @@
+from .http import StaticServer
+from .media import make_clip, make_segments
+from .sink import FlvSink, Impairment, IngestReport
@@ -0,0 +1,45 @@
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import threading
+import time
+
+
+class StaticServer:
+    """
+    Local HTTP stand-in serving the files of a directory in a thread.
+    Every GET is delayed by `delay` seconds and recorded in `requests` as (path, start, end)
+    in seconds since the server is started.
+    """
+
+    def __init__(self, directory, host='127.0.0.1', port=0, delay=0.):
+        self.delay = delay
+        self.requests: list[tuple[str, float, float]] = []
+        self._start_time = time.monotonic()
+        server = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def do_GET(self):
+                start = time.monotonic() - server._start_time
+                time.sleep(server.delay)
+                super().do_GET()
+                server.requests.append((self.path, start, time.monotonic() - server._start_time))
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), partial(Handler, directory=str(directory)))
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='static-http', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._thread.join()
+        self._httpd.server_close()
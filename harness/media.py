@@ -0,0 +1,79 @@
+import math
+import os
+import random
+
+import av
+
+
+def make_clip(path, duration=10., width=320, height=240, fps=30, gop=60, sample_rate=48000, noise=False):
+    """
+    Encode a synthetic H.264/AAC mp4 clip for local tests. The picture brightness changes every frame
+    and the audio is silent.
+
+    :param gop: keyframe interval in frames
+    :param noise: use a still noise picture instead, which gives large keyframes and tiny inter frames
+    """
+    rng = random.Random(0)
+    noise_planes = [rng.randbytes(plane.buffer_size) for plane in av.VideoFrame(width, height, 'yuv420p').planes]
+    with av.open(str(path), 'w') as container:
+        vstream = container.add_stream('libx264', rate=fps)
+        vstream.width, vstream.height, vstream.pix_fmt = width, height, 'yuv420p'
+        vstream.options = {'g': str(gop), 'keyint_min': str(gop), 'preset': 'ultrafast'}
+        astream = container.add_stream('aac', rate=sample_rate)
+        astream.layout = 'stereo'
+        audio_pts = 0
+        for i in range(int(duration * fps)):
+            frame = av.VideoFrame(width, height, 'yuv420p')
+            for plane, noise_plane in zip(frame.planes, noise_planes):
+                plane.update(noise_plane if noise else bytes([i * 2 % 256]) * plane.buffer_size)
+            frame.pts = i
+            container.mux(vstream.encode(frame))
+            while audio_pts < (i + 1) * sample_rate / fps:  # keep the streams interleaved
+                frame = av.AudioFrame(format='fltp', layout='stereo', samples=1024)
+                for plane in frame.planes:
+                    plane.update(bytes(plane.buffer_size))
+                frame.sample_rate = sample_rate
+                frame.pts = audio_pts
+                container.mux(astream.encode(frame))
+                audio_pts += 1024
+        container.mux(vstream.encode())
+        container.mux(astream.encode())
+    return path
+
+
+def make_segments(clip, out_dir, segment_time=2., playlist='index.m3u8'):
+    """
+    Split a clip into MPEG-TS segments at video keyframes and write an m3u8 playlist
+
+    :return: the path of the playlist
+    """
+    segments = []  # (name, start time)
+    output = None
+    with av.open(str(clip)) as source:
+        in_streams = {s.index: s for s in (source.streams.video[0], source.streams.audio[0])}
+        for packet in source.demux(*in_streams.values()):
+            if packet.dts is None:
+                continue
+            time = float(packet.pts * packet.time_base)
+            if packet.stream.type == 'video' and packet.is_keyframe and (
+                    not segments or time - segments[-1][1] >= segment_time):
+                if output is not None:
+                    output.close()
+                segments.append((f'segment{len(segments):04d}.ts', time))
+                output = av.open(os.path.join(out_dir, segments[-1][0]), 'w', format='mpegts')
+                out_streams = {i: output.add_stream_from_template(s) for i, s in in_streams.items()}
+            if output is None:
+                continue
+            packet.stream = out_streams[packet.stream.index]
+            output.mux(packet)
+        end_time = float(source.duration / av.time_base)
+    if output is not None:
+        output.close()
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{math.ceil(segment_time * 2)}']
+    for (name, start), (_, end) in zip(segments, [*segments[1:], (None, end_time)]):
+        lines += [f'#EXTINF:{end - start:.3f},', name]
+    lines.append('#EXT-X-ENDLIST')
+    playlist = os.path.join(out_dir, playlist)
+    with open(playlist, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return playlist
@@ -0,0 +1,148 @@
+"""
+Simulation mode: run the whole pipeline on a virtual clock, as fast as the CPU allows.
+
+- `VirtualClockLoop` jumps to the next timer whenever it has nothing ready to run, so `asyncio.sleep`,
+  `call_later` and the muxer pacing take no real time. While a job is running in the thread pool
+  (opening and demuxing the input), the clock is stopped and the loop waits for it in real time.
+  The timeline therefore does not depend on how fast the machine is.
+- `SimSink` is an output file object for `Player` which parses the FLV it receives and records every tag
+  with its virtual arrival time, in the same `TagRecord` format as `FlvSink`.
+- The check functions take the records and return the problems found, for assertions in tests.
+"""
+import asyncio
+from collections.abc import Coroutine
+import hashlib
+import selectors
+from typing import Optional
+
+from .sink import FlvParser, IngestReport, TagRecord
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    def __init__(self, loop: 'VirtualClockLoop'):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout=None):
+        if self._loop.executor_jobs or timeout is None:
+            # the clock is stopped until the thread posts its result, which wakes up the selector
+            return super().select(None if timeout is None else min(timeout, 0.05))
+        events = super().select(0)
+        if not events and timeout > 0:
+            self._loop.advance(timeout)
+        return events
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self, start_time=0.):
+        self._virtual_time = start_time
+        self.executor_jobs = 0
+        super().__init__(_VirtualSelector(self))
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def advance(self, seconds: float):
+        self._virtual_time += seconds
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self.executor_jobs += 1
+        future.add_done_callback(self._job_done)
+        return future
+
+    def _job_done(self, _):
+        self.executor_jobs -= 1
+
+
+def run(main: Coroutine, debug=None):
+    """`asyncio.run` on a `VirtualClockLoop`"""
+    with asyncio.Runner(debug=debug, loop_factory=VirtualClockLoop) as runner:
+        return runner.run(main)
+
+
+class SimSink:
+    """
+    Output of `Player` in simulation, pass it as the output URL. It must be created in the running loop.
+
+    The output is not seekable, like a network stream. A new FLV header starts a new connection,
+    which is what the player does when it reopens the output.
+    """
+    records: list[TagRecord]
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._parser: Optional[FlvParser] = None
+        self.records = []
+        self.connections = 0
+        self.bytes = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        if data[:3] == b'FLV' and (self._parser is None or not self._parser.pending):
+            self.connections += 1
+            self._parser = FlvParser()
+        now = self._loop.time()  # also read by the thread closing an old output, only the float is read
+        for tag_type, size, timestamp, keyframe in self._parser.feed(data):
+            self.records.append(TagRecord(self.connections, now, size, tag_type, timestamp / 1000, keyframe))
+        self.bytes += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def report(self, jitter_buffer=1., window=0.1) -> IngestReport:
+        return IngestReport.from_records(list(self.records), jitter_buffer, window)
+
+    def digest(self) -> str:
+        """A hash of the whole timeline, equal between runs if the simulation is deterministic"""
+        h = hashlib.sha1()
+        for r in self.records:
+            h.update(f"{r.connection} {r.arrival:.6f} {r.size} {r.type} {r.timestamp:.3f} {r.keyframe}\n".encode())
+        return h.hexdigest()
+
+
+def _media(records: list[TagRecord]) -> list[TagRecord]:
+    return [r for r in records if r.type in ('audio', 'video')]
+
+
+def check_continuity(records: list[TagRecord], max_gap=0.1) -> list[str]:
+    """The timestamps of each stream must increase in each connection without jumping over `max_gap` seconds"""
+    problems = []
+    last: dict[tuple[int, str], float] = {}
+    for r in _media(records):
+        key = (r.connection, r.type)
+        if (prev := last.get(key)) is not None:
+            if r.timestamp < prev:
+                problems.append(f"{r.type} timestamp goes back from {prev:.3f}s to {r.timestamp:.3f}s")
+            elif r.timestamp - prev > max_gap:
+                problems.append(f"{r.type} timestamp jumps from {prev:.3f}s to {r.timestamp:.3f}s")
+        last[key] = r.timestamp
+    return problems
+
+
+def check_av_offset(records: list[TagRecord], max_offset=0.1) -> list[str]:
+    """The latest audio and video timestamps received must stay within `max_offset` seconds of each other"""
+    problems = []
+    latest: dict[str, Optional[float]] = {}
+    connection = None
+    for r in _media(records):
+        if r.connection != connection:
+            connection, latest = r.connection, {}
+        latest[r.type] = r.timestamp
+        if len(latest) == 2 and abs(offset := latest['video'] - latest['audio']) > max_offset:
+            problems.append(f"A/V offset {offset:+.3f}s at {r.arrival:.3f}s")
+    return problems
+
+
+def check_pacing(records: list[TagRecord], max_drift=0.05) -> list[str]:
+    """Each tag must arrive at its timestamp on the clock of the connection, within `max_drift` seconds"""
+    problems = []
+    base = None
+    connection = None
+    for r in _media(records):
+        if r.connection != connection:
+            connection, base = r.connection, r.arrival - r.timestamp
+        if abs(drift := r.arrival - base - r.timestamp) > max_drift:
+            problems.append(f"{r.type} tag at {r.timestamp:.3f}s arrives {drift:+.3f}s off the clock")
+    return problems
@@ -0,0 +1,256 @@
+import asyncio
+from dataclasses import dataclass, field
+import logging
+import socket
+import struct
+import threading
+import time
+from typing import Optional
+
+FLV_TAG_TYPES = {8: 'audio', 9: 'video', 18: 'script'}
+
+
+@dataclass
+class Impairment:
+    """
+    Network impairment applied by `FlvSink` on the receiving side
+
+    :param rate_kbps: throughput cap, the sender is slowed down by TCP backpressure
+    :param latency: one-way delay in seconds added before the data is parsed
+    :param stalls: (start, duration) pairs in seconds since the sink is started, reading is paused during a stall
+    :param drops: times in seconds since the sink is started, the current connection is aborted at each time
+    """
+    rate_kbps: Optional[float] = None
+    latency: float = 0.
+    stalls: list[tuple[float, float]] = field(default_factory=list)
+    drops: list[float] = field(default_factory=list)
+
+
+@dataclass
+class TagRecord:
+    connection: int
+    arrival: float  # seconds since the sink is started
+    size: int
+    type: str
+    timestamp: float  # FLV tag timestamp in seconds
+    keyframe: bool
+
+
+class FlvParser:
+    """Incremental FLV parser, yields (tag type, size, timestamp in ms, keyframe) for each complete tag"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._header_done = False
+
+    @property
+    def pending(self) -> bool:
+        """Whether a tag is partially received"""
+        return bool(self._buffer)
+
+    def feed(self, data: bytes):
+        self._buffer += data
+        if not self._header_done:
+            if len(self._buffer) < 13:
+                return
+            if self._buffer[:3] != b'FLV':
+                raise ValueError("not an FLV stream")
+            header_size = struct.unpack('>I', self._buffer[5:9])[0]
+            del self._buffer[:header_size + 4]  # header and PreviousTagSize0
+            self._header_done = True
+        while len(self._buffer) >= 11:
+            tag_type = self._buffer[0] & 0x1f
+            data_size = int.from_bytes(self._buffer[1:4], 'big')
+            if len(self._buffer) < 11 + data_size + 4:
+                return
+            timestamp = int.from_bytes(self._buffer[4:7], 'big') | self._buffer[7] << 24
+            keyframe = tag_type == 9 and data_size > 0 and self._buffer[11] >> 4 == 1
+            del self._buffer[:11 + data_size + 4]
+            yield FLV_TAG_TYPES.get(tag_type, str(tag_type)), 11 + data_size + 4, timestamp, keyframe
+
+
+class FlvSink:
+    """
+    Local stand-in for the RTMP ingest server, receiving FLV over TCP (``tcp://127.0.0.1:port``).
+
+    The server runs its own event loop in a thread, because `Player` writes to the output synchronously
+    and would otherwise block the sink running in the same loop.
+    Every tag is recorded with its arrival time and size, see `report` for the ingest-side statistics.
+    The bytes received are also recorded as they arrive, so the rate is measured on the wire and not only
+    when each tag is complete.
+    """
+    records: list[TagRecord]
+    arrivals: list[tuple[float, int]]  # (arrival time, bytes) of each read
+
+    def __init__(self, host='127.0.0.1', port=0, impairment: Impairment = None, chunk_size=4096):
+        self.host = host
+        self.port = port
+        self.impairment = Impairment() if impairment is None else impairment
+        self.chunk_size = chunk_size
+        self.records = []
+        self.arrivals = []
+        self.connections = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+        self._stop: Optional[asyncio.Event] = None
+        self._start_time = None
+        self._handlers: set[tuple[asyncio.Task, asyncio.StreamWriter]] = set()
+
+    @property
+    def url(self):
+        return f"tcp://{self.host}:{self.port}"
+
+    def now(self):
+        return time.monotonic() - self._start_time
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=asyncio.run, args=(self._serve(),), name='flv-sink', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._start_time = time.monotonic()
+        # keep the receiving buffers small like a slow link, so the throughput cap pushes back on the sender
+        # instead of the bytes piling up here
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.chunk_size)
+        sock.bind((self.host, self.port))
+        server = await asyncio.start_server(self._handle, sock=sock, limit=self.chunk_size)
+        self.port = sock.getsockname()[1]
+        self._started.set()
+        async with server:
+            await self._stop.wait()
+            for task, writer in list(self._handlers):
+                writer.transport.abort()
+                await task
+
+    async def _wait_stalls(self):
+        for start, duration in self.impairment.stalls:
+            if start <= self.now() < start + duration:
+                await asyncio.sleep(start + duration - self.now())
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        connection = self.connections
+        logging.info(f"sink connection {connection} is accepted")
+        parser = FlvParser()
+        delay_line = asyncio.Queue()
+        drops = [t for t in self.impairment.drops if t > self.now()]
+        rate = None if self.impairment.rate_kbps is None else self.impairment.rate_kbps * 125  # bytes/s
+
+        async def parse():
+            while (item := await delay_line.get()) is not None:
+                due, data = item
+                if (wait := due - self.now()) > 0:
+                    await asyncio.sleep(wait)
+                self.arrivals.append((self.now(), len(data)))
+                for tag_type, size, timestamp, keyframe in parser.feed(data):
+                    self.records.append(TagRecord(connection, self.now(), size, tag_type, timestamp / 1000, keyframe))
+
+        parse_task = asyncio.create_task(parse())
+        handler = (asyncio.current_task(), writer)
+        self._handlers.add(handler)
+        try:
+            while True:
+                await self._wait_stalls()
+                if drops and self.now() >= drops[0]:
+                    logging.info(f"sink connection {connection} is dropped")
+                    writer.transport.abort()
+                    break
+                begin = self.now()
+                data = await reader.read(self.chunk_size)
+                if not data:
+                    break
+                delay_line.put_nowait((self.now() + self.impairment.latency, data))
+                if rate is not None and (wait := len(data) / rate - (self.now() - begin)) > 0:
+                    await asyncio.sleep(wait)
+        except (ConnectionError, ValueError) as e:
+            logging.warning(f"sink connection {connection} is broken: {e!r}")
+        finally:
+            self._handlers.discard(handler)
+            delay_line.put_nowait(None)
+            await parse_task
+            writer.close()
+
+    def report(self, jitter_buffer=1., window=0.1) -> 'IngestReport':
+        return IngestReport.from_records(list(self.records), jitter_buffer, window, list(self.arrivals))
+
+
+@dataclass
+class IngestReport:
+    """
+    Ingest-side timing of a recording
+
+    - underruns: tags arriving after their playout deadline. The playout of each connection starts
+      `jitter_buffer` seconds after its first tag, a late tag pushes the playout clock back.
+    - burstiness: peak / mean of the bytes received in each `window`, counted as they arrive if `arrivals`
+      is given, otherwise when each tag is complete
+    - reconnect gaps: time between the last tag of a connection and the first tag of the next one
+    """
+    tags: int
+    bytes: int
+    duration: float
+    connections: int
+    underruns: int
+    audio_underruns: int
+    underrun_time: float
+    burstiness: float
+    peak_kbps: float
+    mean_kbps: float
+    reconnect_gaps: list[float]
+
+    @classmethod
+    def from_records(cls, records: list[TagRecord], jitter_buffer=1., window=0.1,
+                     arrivals: list[tuple[float, int]] = None):
+        media = [r for r in records if r.type in ('audio', 'video')]
+        if not media:
+            return cls(0, 0, 0., 0, 0, 0, 0., 0., 0., 0., [])
+        duration = media[-1].arrival - media[0].arrival
+        underruns, audio_underruns, underrun_time = 0, 0, 0.
+        reconnect_gaps = []
+        playout_start = None
+        for prev, r in zip([None, *media], media):
+            if prev is None or prev.connection != r.connection:
+                if prev is not None:
+                    reconnect_gaps.append(r.arrival - prev.arrival)
+                playout_start = r.arrival + jitter_buffer - r.timestamp
+                continue
+            late = r.arrival - (playout_start + r.timestamp)
+            if late > 0:
+                underruns += 1
+                audio_underruns += r.type == 'audio'
+                underrun_time += late
+                playout_start += late
+        if arrivals is None:
+            arrivals = [(r.arrival, r.size) for r in media]
+        bins = {}
+        for arrival, size in arrivals:
+            key = int((arrival - arrivals[0][0]) / window)
+            bins[key] = bins.get(key, 0) + size
+        total = sum(r.size for r in media)
+        mean_rate = total / max(duration, window)
+        peak_rate = max(bins.values()) / window
+        return cls(
+            tags=len(media), bytes=total, duration=duration,
+            connections=len({r.connection for r in media}),
+            underruns=underruns, audio_underruns=audio_underruns, underrun_time=underrun_time,
+            burstiness=peak_rate / mean_rate, peak_kbps=peak_rate / 125, mean_kbps=mean_rate / 125,
+            reconnect_gaps=reconnect_gaps,
+        )
+
+    def __str__(self):
+        gaps = ', '.join(f'{g:.3f}s' for g in self.reconnect_gaps) or 'none'
+        return (f"{self.tags} tags, {self.bytes / 1024:.1f} KiB in {self.duration:.3f}s "
+                f"over {self.connections} connection(s)\n"
+                f"underruns: {self.underruns} ({self.underrun_time:.3f}s in total, {self.audio_underruns} of audio)\n"
+                f"rate: mean {self.mean_kbps:.1f} kbit/s, peak {self.peak_kbps:.1f} kbit/s, "
+                f"burstiness {self.burstiness:.2f}\n"
+                f"reconnect gaps: {gaps}")
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import random
+from types import SimpleNamespace
+
+from pyrogram.errors import GroupCallInvalid
+from pyrogram.raw import functions, types
+
+
+class FakeClient:
+    """
+    In-process stand-in for the part of the Pyrogram client surface used by the bot.
+    Every call sleeps `rtt` seconds to emulate a round trip to Telegram, and is recorded in `calls`.
+    """
+
+    def __init__(self, name='fake', rtt=0.):
+        self.name = name
+        self.rtt = rtt
+        self.calls: list[tuple[str, object]] = []
+        self.call = types.InputGroupCall(id=random.getrandbits(63), access_hash=random.getrandbits(63))
+        self.title = None
+        self.channel_id = None
+
+    async def _round_trip(self, name, detail=None):
+        self.calls.append((name, detail))
+        await asyncio.sleep(self.rtt)
+
+    async def resolve_peer(self, chat_id):
+        await self._round_trip('resolve_peer', chat_id)
+        self.channel_id = abs(int(chat_id))
+        return types.InputPeerChannel(channel_id=self.channel_id, access_hash=0)
+
+    async def invoke(self, query):
+        await self._round_trip('invoke', type(query).__name__)
+        match query:
+            case functions.channels.GetFullChannel():
+                # only the fields read by bot_lib.phone are filled
+                full_chat = object.__new__(types.messages.ChatFull)
+                full_chat.full_chat = SimpleNamespace(call=self.call)
+                full_chat.chats = full_chat.users = []
+                return full_chat
+            case functions.phone.EditGroupCallTitle():
+                if self.call is None or query.call.id != self.call.id:
+                    raise GroupCallInvalid()
+                self.title = query.title
+                call = types.GroupCall(id=self.call.id, access_hash=self.call.access_hash, participants_count=0,
+                                       unmuted_video_limit=0, version=1, rtmp_stream=True, title=self.title)
+                return types.Updates(updates=[types.UpdateGroupCall(chat_id=self.channel_id, call=call)],
+                                     users=[], chats=[], date=0, seq=0)
+            case functions.phone.GetGroupCallStreamRtmpUrl():
+                return types.phone.GroupCallStreamRtmpUrl(url='rtmp://127.0.0.1/fake/', key='key')
+        raise NotImplementedError(f"{type(query).__name__} is not faked")
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        await self._round_trip('edit_message_text', text)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._round_trip('send_message', text)
+        return FakeMessage(self)
+
+
+class FakeMessage:
+    def __init__(self, client: FakeClient):
+        self._client = client
+        self.texts: list[str] = []
+
+    async def edit_text(self, text, **kwargs):
+        await self._client._round_trip('edit_text', text)
+        self.texts.append(text)
+        return self
+
+    async def reply(self, text, **kwargs):
+        await self._client._round_trip('reply', text)
+        return FakeMessage(self._client)
+
+
+class FakeCallbackQuery:
+    def __init__(self, client: FakeClient, regex, data: str):
+        self.data = data
+        self.matches = [regex.match(data)]
+        self.message = FakeMessage(client)
+
+
+def local_open_telegram(root):
+    """Return an `open_telegram` replacement reading ``tg://path`` from the local directory `root`"""
+
+    def open_telegram(_client, path):
+        return open(os.path.join(root, path), 'rb')
+
+    return open_telegram
@@ -1,2 +1,4 @@
 from .danmaku import Danmaku
 from .player import Progress, Player
+from .segments import SegmentedSource
+from .utils import StageTimer
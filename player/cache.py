@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from fractions import Fraction
+import functools
+import io
+import logging
+from typing import Hashable, Literal, Optional
+
+import av
+
+
+@dataclass
+class CachedPacket:
+    data: bytes
+    pts: int
+    dts: int
+    time_base: Fraction
+    type: Literal['video', 'audio']
+    is_keyframe: bool
+
+
+@dataclass
+class CachedClip:
+    """
+    The raw packets of a whole clip, before the timestamps are modified.
+    The streams of `templates` are copied from the input, to set up the output streams when replaying.
+    """
+    templates: av.container.OutputContainer
+    packets: list[CachedPacket] = field(default_factory=list)
+    size: int = 0
+
+    @classmethod
+    def recorder(cls, input_container) -> 'CachedClip':
+        # a container which is never written, only holding the stream parameters
+        templates = av.open(io.BytesIO(), 'w', format='flv')
+        for t in ['video', 'audio']:
+            templates.add_stream_from_template(getattr(input_container.streams, t)[0], True)
+        return cls(templates)
+
+    def add(self, packet: CachedPacket):
+        self.packets.append(packet)
+        self.size += len(packet.data)
+
+    def record(self, packet: av.Packet):
+        """Copy a packet from the input, before its timestamps are modified"""
+        self.add(CachedPacket(bytes(packet), packet.pts, packet.dts, packet.time_base, packet.stream.type,
+                              packet.is_keyframe))
+
+    def replay(self, streams: dict, start=0.):
+        """
+        Create new packets from the cache, starting from the last video keyframe not later than `start`
+
+        :param streams: the stream of each packet type to assign to the packets
+        """
+        first = 0
+        if start:
+            for i, p in enumerate(self.packets):
+                if p.type == 'video' and p.is_keyframe:
+                    if p.pts * p.time_base > start:
+                        break
+                    first = i
+        for p in self.packets[first:]:
+            packet = av.Packet(p.data)
+            packet.pts, packet.dts, packet.time_base = p.pts, p.dts, p.time_base
+            packet.is_keyframe = p.is_keyframe
+            packet.stream = streams[p.type]
+            yield packet
+
+
+def cache_key(file) -> Optional[Hashable]:
+    """A key identifying the input, None if it cannot be identified"""
+    if isinstance(file, str):
+        return file
+    if isinstance(file, functools.partial):
+        try:
+            key = (file.func, file.args, tuple(sorted(file.keywords.items())))
+            hash(key)
+            return key
+        except TypeError:
+            return None
+    return None
+
+
+class ClipCache:
+    """
+    LRU cache of short clips in memory, so looping or replaying them needs no I/O at all.
+
+    :param max_bytes: memory budget of all cached packets
+    :param max_duration: only clips not longer than this (in seconds) are cached
+    :param max_clip_bytes: and not larger than this
+    """
+    _clips: OrderedDict[Hashable, CachedClip]
+
+    def __init__(self, max_bytes=256 << 20, max_duration=120., max_clip_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.max_duration = max_duration
+        self.max_clip_bytes = min(max_clip_bytes, max_bytes)
+        self._clips = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._clips)
+
+    def get(self, key) -> Optional[CachedClip]:
+        if key is None or (clip := self._clips.get(key)) is None:
+            return None
+        self._clips.move_to_end(key)
+        return clip
+
+    def recorder(self, input_container) -> Optional[CachedClip]:
+        """A new clip to record the input into, None if the input is too long to be cached"""
+        duration = input_container.duration
+        if duration is None or duration / av.time_base > self.max_duration:
+            return None
+        return CachedClip.recorder(input_container)
+
+    def put(self, key, clip: CachedClip):
+        if key is None or clip.size > self.max_clip_bytes:
+            return
+        if (old := self._clips.pop(key, None)) is not None:
+            self.size -= old.size
+        while self._clips and self.size + clip.size > self.max_bytes:
+            _, evicted = self._clips.popitem(last=False)
+            self.size -= evicted.size
+        self._clips[key] = clip
+        self.size += clip.size
+        logging.info(f"clip cached: {len(clip.packets)} packets, {clip.size / 1024:.0f} KiB, "
+                     f"{len(self._clips)} clips {self.size / 1024:.0f} KiB in total")
@@ -0,0 +1,140 @@
+from array import array
+import bisect
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, fields
+import logging
+import os
+import sqlite3
+import statistics
+from typing import Optional
+
+import av
+
+
+@dataclass
+class MediaInfo:
+    name: str
+    path: str
+    mtime: Optional[float]
+    size: Optional[int]
+    duration: Optional[float]
+    bit_rate: Optional[int]
+    video_codec: str
+    width: int
+    height: int
+    frame_rate: Optional[float]
+    audio_codec: str
+    sample_rate: int
+    channels: int
+    keyframes: array = field(default_factory=lambda: array('d'), repr=False)  # keyframe pts in seconds
+
+    @property
+    def keyframe_interval(self) -> Optional[float]:
+        if len(self.keyframes) < 2:
+            return None
+        return statistics.median(b - a for a, b in zip(self.keyframes, self.keyframes[1:]))
+
+    def keyframe_before(self, time: float) -> float:
+        """The latest keyframe time not later than `time`, which is where a seek really starts"""
+        i = bisect.bisect_right(self.keyframes, time)
+        return float(self.keyframes[i - 1]) if i else 0.
+
+    def compatible_with(self, streams: dict) -> bool:
+        """Predict the result of the compatibility test against the output streams of `Player`"""
+        return (
+            self.sample_rate == streams['audio'].sample_rate and
+            self.width == streams['video'].width and
+            self.height == streams['video'].height
+        )
+
+
+def probe_file(name: str, path: str) -> MediaInfo:
+    """Read the stream parameters and the keyframe index. Runs in a worker process of `build_catalog`."""
+    stat = None if path.startswith('http') else os.stat(path)
+    with av.open(path, metadata_errors='ignore') as container:
+        vstream = container.streams.video[0]
+        astream = container.streams.audio[0]
+        keyframes = array('d')
+        for packet in container.demux(vstream):
+            if packet.is_keyframe and packet.pts is not None:
+                keyframes.append(float(packet.pts * packet.time_base))
+        return MediaInfo(
+            name=name, path=path,
+            mtime=None if stat is None else stat.st_mtime,
+            size=None if stat is None else stat.st_size,
+            duration=None if container.duration is None else container.duration / av.time_base,
+            bit_rate=container.bit_rate,
+            video_codec=vstream.codec_context.name,
+            width=vstream.codec_context.width,
+            height=vstream.codec_context.height,
+            frame_rate=None if vstream.average_rate is None else float(vstream.average_rate),
+            audio_codec=astream.codec_context.name,
+            sample_rate=astream.codec_context.sample_rate,
+            channels=astream.codec_context.layout.nb_channels,
+            keyframes=array('d', sorted(keyframes)),
+        )
+
+
+class Catalog:
+    """
+    Media parameters of the library, probed in advance by `build_catalog` and stored in a SQLite database.
+    The keyframe index is stored as a float64 array blob, float32 is not precise enough for the pts of a long video.
+    """
+    _columns = [f.name for f in fields(MediaInfo)]
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS media ({', '.join(self._columns)}, PRIMARY KEY (name))")
+
+    def get(self, name: str) -> Optional[MediaInfo]:
+        row = self._db.execute(f"SELECT {', '.join(self._columns)} FROM media WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        info = MediaInfo(*row)
+        info.keyframes = array('d', info.keyframes)
+        return info
+
+    def put(self, info: MediaInfo):
+        values = [getattr(info, c) for c in self._columns]
+        values[-1] = info.keyframes.tobytes()
+        with self._db:
+            self._db.execute(f"INSERT OR REPLACE INTO media VALUES ({', '.join('?' * len(values))})", values)
+
+    def is_fresh(self, name: str, path: str) -> bool:
+        """Whether the entry exists and the local file is not changed since probing"""
+        row = self._db.execute("SELECT path, mtime, size FROM media WHERE name = ?", (name,)).fetchone()
+        if row is None or row[0] != path:
+            return False
+        if row[1] is None:  # remote file
+            return True
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return (stat.st_mtime, stat.st_size) == (row[1], row[2])
+
+    def close(self):
+        self._db.close()
+
+
+def build_catalog(catalog: Catalog, paths: dict[str, str], workers=None, refresh=False):
+    """
+    Probe the files with a process pool and store the results
+
+    :param paths: name -> file path or URL
+    :param refresh: probe all files again even if the entries are fresh
+    """
+    pending = {name: path for name, path in paths.items() if refresh or not catalog.is_fresh(name, path)}
+    logging.info(f"probing {len(pending)} of {len(paths)} files")
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(probe_file, name, path): name for name, path in pending.items()}
+        for i, future in enumerate(as_completed(futures)):
+            name = futures[future]
+            try:
+                info = future.result()
+            except Exception as e:
+                logging.warning(f"cannot probe {name}: {e!r}")
+                continue
+            catalog.put(info)
+            logging.info(f"[{i + 1}/{len(futures)}] {name}: {info.duration}s, {info.width}x{info.height}, "
+                         f"{len(info.keyframes)} keyframes")
@@ -1,13 +1,109 @@
 import asyncio
+import bisect
 from collections import deque
+import heapq
 import logging
-from typing import Optional, Any, Callable, Awaitable, Union
+import math
+import random
+import re
+from typing import Optional, Any, Callable, Awaitable, Union, Sequence
 from functools import partial
+import unicodedata
 
-from pyrogram.errors import MessageNotModified
-
+from .supervisor import Supervisor
 from .utils import _run_callback
 
+_log = logging.getLogger('player.danmaku')  # the logs of each round
+_ignored_chars_regex = re.compile(r'[\W_]+')
+_repeated_regex = re.compile(r'(.+?)\1+')  # the whole text is a unit repeated, e.g. "哈哈哈", "awsl awsl"
+
+
+def _dedup_key(text: str) -> str:
+    """
+    Normalize the text so that near-duplicates like "哈哈哈" and "哈哈哈哈！" share the same key.
+    Only a text made of one repeated unit is collapsed, so "good" and "god", or "test 1" and "test 11" stay apart.
+    """
+    key = unicodedata.normalize('NFKC', text).casefold()
+    key = _ignored_chars_regex.sub('', key) or key  # keep symbol-only text (e.g. emoji) as it is
+    return m[1] if (m := _repeated_regex.fullmatch(key)) else key
+
+
+class IntervalSampler:
+    """
+    Collect the danmaku of one update interval with bounded memory.
+
+    - Near-duplicates are collapsed into one group with a count, displayed as "text ×count".
+    - At most `capacity` groups are kept. Extra groups are sampled by reservoir sampling,
+      and a repeated group is never replaced by a new single one.
+    - The groups left out by the sampling are still counted (at most `4 * capacity` of them), and one that
+      repeats takes the place of a single group, so its count includes the copies seen before it got in.
+    - `drain` picks the most repeated groups and returns the others as candidates for the stale buffer.
+    """
+    capacity: int
+    _groups: dict[str, list]  # key -> [first time, text, count]
+    _keys: list[str]
+    _rejected: dict[str, list]  # the groups not in the sample, in the same form as `_groups`
+    _seen: int
+
+    def __init__(self, capacity: int, rng: random.Random = None):
+        self.capacity = max(int(capacity), 1)
+        self._rng = random.Random() if rng is None else rng
+        self._groups = {}
+        self._keys = []
+        self._rejected = {}
+        self._seen = 0
+
+    def add(self, time: float, text: str):
+        key = _dedup_key(text)
+        if (group := self._groups.get(key)) is not None:
+            group[2] += 1
+            return
+        if (group := self._rejected.get(key)) is not None:
+            group[2] += 1
+            singles = [i for i, k in enumerate(self._keys) if self._groups[k][2] == 1]
+            if singles:
+                self._replace(self._rng.choice(singles), key, self._rejected.pop(key))
+            return
+        self._seen += 1
+        group = [time, text, 1]
+        if len(self._keys) < self.capacity:
+            self._keys.append(key)
+            self._groups[key] = group
+            return
+        slot = self._rng.randrange(self._seen)
+        if slot >= self.capacity or self._groups[self._keys[slot]][2] > 1:
+            self._reject(key, group)
+        else:
+            self._replace(slot, key, group)
+
+    def _replace(self, slot: int, key: str, group: list):
+        old_key = self._keys[slot]
+        self._reject(old_key, self._groups.pop(old_key))
+        self._keys[slot] = key
+        self._groups[key] = group
+
+    def _reject(self, key: str, group: list):
+        if len(self._rejected) >= 4 * self.capacity:
+            del self._rejected[next(iter(self._rejected))]  # forget the oldest one
+        self._rejected[key] = group
+
+    def drain(self, count: int) -> tuple[list[str], list[tuple[float, str]]]:
+        """
+        Pick at most `count` groups in time order and reset the sampler
+
+        :return: the selected lines and the unselected (time, text) items
+        """
+        groups = list(self._groups.values())
+        selected = heapq.nlargest(count, groups, key=lambda g: g[2]) if count > 0 else []
+        selected_ids = set(map(id, selected))
+        rest = [(g[0], g[1]) for g in groups if id(g) not in selected_ids]
+        self._groups.clear()
+        self._keys.clear()
+        self._rejected.clear()
+        self._seen = 0
+        selected.sort(key=lambda g: g[0])
+        return [text if n == 1 else f"{text} ×{n}" for _, text, n in selected], rest
+
 
 class Danmaku:
     """
@@ -18,45 +114,81 @@ class Danmaku:
 
     - External callback function for real operation. The callback is called with a fixed time interval.
 
+    - Sharded display: with a list of K callbacks (e.g. K messages, each edited by a different bot),
+      the updates go to the callbacks in turn every `update_interval / K` seconds. Each callback keeps its own
+      lines, so the lines never move between messages, and each message is still edited once per
+      `update_interval`, while the total update rate is K times of a single message.
+
     - For synchronization, the start_time and current_time should be updated externally.
       Danmaku time falling between the old and new time will be picked and displayed.
+      When the video starts in the middle, set `start_position` to where it starts, the danmaku before it
+      are skipped instead of being sampled all at once.
 
-    - The number of updated items will be kept at the `update_count` number. Extra danmaku will be discarded.
-      Insufficient danmaku will be loaded from the previous discarded items (if exist).
+    - The number of updated items will be kept at the `update_count` number. The danmaku of each interval
+      go through an `IntervalSampler`, so near-duplicates are collapsed and the work per update is bounded.
+      Insufficient danmaku will be loaded from the previous discarded items (if exist),
+      at most the items discarded in the last `buffer_time` seconds are kept.
 
     - The playing time should flow forward. Use `restart` to reset time and start again.
+
+    - The updater is cancelled if `current_time` does not change for `inactive_timeout` seconds.
+      Each message edit runs as a separate task, so a slow edit does not delay the schedule.
     """
     data: Optional[list] = None
     _reader_task: asyncio.Task
+    _sampler: IntervalSampler
     _stale_buffer: Optional[deque[tuple[float, str]]]
-    _active_buffer: deque[str]
-    update_callback: Callable[[str], Awaitable]
+    _active_buffers: list[deque[str]]  # one for each shard
+    update_callbacks: list[Callable[[str], Awaitable]]
     update_count: int
     update_interval: float
     _name: Any
     updater: asyncio.Task
     start_time: Optional[float]
-    current_time: Optional[float]
-    _watchdog: asyncio.Task = None
+    start_position: float  # the video time at start_time
+    _current_time: Optional[float] = None
+    _last_progress: float
+    _watchdog: Optional[asyncio.TimerHandle] = None
 
-    def __init__(self, file: Union[str, Callable[[], Any]], update_callback: Callable[[str], Awaitable],
+    def __init__(self, file: Union[str, Callable[[], Any]],
+                 update_callback: Union[Callable[[str], Awaitable], Sequence[Callable[[str], Awaitable]]],
                  total_count=20,
                  update_count=5,
                  update_interval=3,
-                 buffer_time=5):
+                 buffer_time=5,
+                 sample_capacity=None,
+                 inactive_timeout=60):
         self._name = file
+        self._loop = asyncio.get_running_loop()
+        self._supervisor = Supervisor('danmaku')
         self._reader_task = asyncio.create_task(self._reader(file))
-        if buffer_time > 0:
-            self._stale_buffer = deque()
-        else:
-            self._stale_buffer = None
         total_count = max(int(total_count), 0)
         self.update_count = min(max(int(update_count), 0), total_count)
-        self._active_buffer = deque(maxlen=total_count)
-        self.update_callback = update_callback
+        self.update_callbacks = list(update_callback) if isinstance(update_callback, Sequence) else [update_callback]
+        self._active_buffers = [deque(maxlen=total_count) for _ in self.update_callbacks]
+        self._shard = 0
         self.update_interval = max(update_interval, 0)
-        self.updater = asyncio.create_task(self._update_coro())
+        self._tick = self.update_interval / len(self.update_callbacks)
+        if buffer_time > 0:
+            intervals = math.ceil(buffer_time / self._tick) if self._tick else 1
+            self._stale_buffer = deque(maxlen=max(self.update_count * intervals, 1))
+        else:
+            self._stale_buffer = None
+        self._sampler = IntervalSampler(4 * self.update_count if sample_capacity is None else sample_capacity)
+        self.inactive_timeout = inactive_timeout
         self.start_time = self.current_time = None
+        self.start_position = 0.
+        self._start_updater()
+
+    @property
+    def current_time(self) -> Optional[float]:
+        return self._current_time
+
+    @current_time.setter
+    def current_time(self, value: Optional[float]):
+        if value != self._current_time:
+            self._last_progress = self._loop.time()
+        self._current_time = value
 
     def _reader(self, file):
         def read(_opener):
@@ -96,10 +228,28 @@ class Danmaku:
 
         return asyncio.to_thread(read, opener)
 
-    async def _update_coro(self):
+    def _start_updater(self):
         if self._watchdog is not None:
             self._watchdog.cancel()
-        self._watchdog = asyncio.create_task(self._watchdog_coro())
+        self._last_progress = self._loop.time()
+        self._watchdog = self._loop.call_later(self.inactive_timeout, self._check_activity)
+        self.updater = self._supervisor.start('updater', self._update_coro, on_exit=self._on_updater_exit)
+
+    def _check_activity(self):
+        idle = self._loop.time() - self._last_progress
+        if idle < self.inactive_timeout:
+            self._watchdog = self._loop.call_later(self.inactive_timeout - idle, self._check_activity)
+            return
+        logging.error(f"Danmaku is inactive over {self.inactive_timeout}s, exiting.")
+        self._watchdog = None
+        self.updater.cancel()
+
+    def _on_updater_exit(self, task):
+        if task is self.updater and self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+
+    async def _update_coro(self):
         try:
             await self._reader_task
             # wait until start_time & current_time is set
@@ -107,63 +257,68 @@ class Danmaku:
                 logging.debug(f"danmaku {self._name} is loaded but not started")
                 await asyncio.sleep(self.update_interval)
             self.start_time: float  # type hint
-            self.current_time: float  # type hint
-            logging.info(f"start streaming danmaku file: {self._name}")
-            count = self.update_count
-            for data_i in self.data:
+            logging.info(f"start streaming danmaku file: {self._name} from {self.start_position:.3f}s")
+            for i in range(bisect.bisect_left(self.data, (self.start_position,)), len(self.data)):
+                data_i = self.data[i]
                 while data_i[0] > self.current_time - self.start_time:
-                    await self._do_update(count)
-                    count = self.update_count
-                    await asyncio.sleep(self.update_interval)
-                if count > 0:
-                    self._active_buffer.append(data_i[1])
-                else:
-                    if self._stale_buffer is not None:
-                        self._stale_buffer.append(data_i)
-                count -= 1
-            await self._do_update(count)
+                    self._sample_and_update()
+                    await asyncio.sleep(self._tick)
+                self._sampler.add(*data_i)
+            self._sample_and_update()
             logging.info(f"danmaku updater is finished: {self._name}")
         except asyncio.CancelledError:
             logging.info(f"danmaku updater is cancelled: {self._name}")
             raise
-        except Exception as e:
-            logging.error(f"danmaku updater get an exception, file: {self._name}, exception: {repr(e)}")
-            raise
 
-    async def _watchdog_coro(self):
-        PROBE_NUM = 4
-        curr_time_history = deque(maxlen=PROBE_NUM)
-        while not self.updater.done():
-            curr_time = self.current_time
-            curr_time_history.append(curr_time)
-            if curr_time_history.count(curr_time) == PROBE_NUM:
-                logging.error("Danmaku is inactive over 60s, exiting.")
-                self.updater.cancel()
-            await asyncio.sleep(20)
-
-    async def _do_update(self, count):
+    def _sample_and_update(self):
+        selected, rest = self._sampler.drain(self.update_count)
+        shard = self._shard
+        self._shard = (shard + 1) % len(self.update_callbacks)
+        self._active_buffers[shard].extend(selected)
+        if self._stale_buffer is not None:
+            self._stale_buffer.extend(rest)
+        self._do_update(shard, self.update_count - len(selected))
+
+    def _do_update(self, shard, count):
+        active_buffer = self._active_buffers[shard]
         if count > 0:
-            logging.info(f"New danmaku is not enough. Fill {count} slots from buffer.")
+            _log.info(f"New danmaku is not enough. Fill {count} slots from buffer.")
             while count > 0 and self._stale_buffer:
-                self._active_buffer.append(self._stale_buffer.pop()[1])
+                active_buffer.append(self._stale_buffer.pop()[1])
                 count -= 1
             if count > 0:
                 if count == self.update_count:
-                    logging.warning(f"no new danmaku, skip this round")
+                    _log.warning(f"no new danmaku, skip this round")
                     return
                 else:
-                    logging.warning(f"Danmaku is not enough. {count} in {self.update_count} is not updated")
-        new_message = '\n'.join(self._active_buffer)
+                    _log.warning(f"Danmaku is not enough. {count} in {self.update_count} is not updated")
+        new_message = '\n'.join(active_buffer)
+        if self._supervisor.get(f'edit.{shard}') is not None:
+            _log.warning(f"the last danmaku edit of shard {shard} is not finished, skip this round")
+            return
+        self._supervisor.start(f'edit.{shard}', partial(self._edit, shard, new_message))
+
+    async def _edit(self, shard, new_message):
+        from pyrogram.errors import MessageNotModified  # not imported by the demux process of `IsolatedDemuxer`
         try:
-            await self.update_callback(new_message)
+            await self.update_callbacks[shard](new_message)
         except MessageNotModified:
-            logging.info(f"danmaku content is not modified")
+            _log.info(f"danmaku content is not modified")
         except Exception as e:
             logging.error(f"update_callback get an exception, new message: {new_message}, exception: {repr(e)}")
 
     def restart(self):
         self.updater.cancel()
-        self._stale_buffer.clear()
-        self._active_buffer.clear()
+        for shard, active_buffer in enumerate(self._active_buffers):
+            self._supervisor.cancel(f'edit.{shard}')
+            active_buffer.clear()
+        self._shard = 0
+        if self._stale_buffer is not None:
+            self._stale_buffer.clear()
+        self._sampler.drain(0)
         self.start_time = self.current_time = None
-        self.updater = asyncio.create_task(self._update_coro())
+        self.start_position = 0.
+        self._start_updater()
+
+    def close(self):
+        self._supervisor.cancel_all()
@@ -0,0 +1,308 @@
+import asyncio
+from fractions import Fraction
+import json
+import logging
+from multiprocessing import resource_tracker, shared_memory
+import os
+import struct
+import sys
+from typing import NamedTuple, Optional
+
+import av
+
+from .logs import setup_logging
+
+# record kinds
+PACKET, SWITCH, LOOP = 1, 2, 3
+_STREAM_TYPES = ('video', 'audio')
+
+_POSITION = struct.Struct('<Q')
+_WRITE_POS, _READ_POS, _CAPACITY = 0, 64, 128  # separate cache lines for the two sides
+_DATA = 192
+# payload length, kind, stream type, keyframe, pts, dts, time base, dts time, pts time
+_RECORD = struct.Struct('<IBBBxqqiidd')
+_PADDING = 0xFFFFFFFF
+
+
+class Record(NamedTuple):
+    kind: int
+    pkt_type: str
+    keyframe: bool
+    pts: int
+    dts: int
+    time_base: Optional[Fraction]
+    dtime: float  # SWITCH: the switch time
+    ptime: float  # SWITCH: the offset
+    payload: bytes
+
+
+class PacketRing:
+    """
+    Single-producer single-consumer ring buffer of packet records in shared memory.
+
+    - `write_pos` and `read_pos` are monotonic byte counters, each of them is only written by one side.
+      A record is written completely before `write_pos` is advanced, and copied out before `read_pos` is advanced.
+    - A record never wraps around, the tail of the buffer is skipped with a padding marker instead.
+    - The payload is copied into the ring directly from the packet buffer, nothing is pickled.
+    """
+
+    def __init__(self, name: str = None, capacity: int = 16 << 20):
+        if name is None:
+            capacity = _align(capacity)
+            self._shm = shared_memory.SharedMemory(create=True, size=_DATA + capacity)
+            _POSITION.pack_into(self._shm.buf, _CAPACITY, capacity)
+            self._owner = True
+        elif sys.version_info >= (3, 13):
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+            self._owner = False
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            # the resource tracker of the child process would unlink the memory when the child exits
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+            self._owner = False
+        self.buf = self._shm.buf
+        self.capacity = self._load(_CAPACITY)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def _load(self, offset) -> int:
+        return _POSITION.unpack_from(self.buf, offset)[0]
+
+    def _store(self, offset, value):
+        _POSITION.pack_into(self.buf, offset, value)
+
+    def write(self, kind, pkt_type=0, keyframe=False, pts=0, dts=0, time_base=(0, 1), dtime=0., ptime=0.,
+              payload=b'') -> bool:
+        """Append a record, return False if there is not enough free space now"""
+        length = len(payload)
+        size = _align(_RECORD.size + length)
+        if size > self.capacity // 2:
+            raise ValueError(f"a record of {size} bytes is too large for the ring of {self.capacity} bytes")
+        write_pos = self._load(_WRITE_POS)
+        offset = write_pos % self.capacity
+        tail = self.capacity - offset
+        skip = tail if tail < size else 0
+        if write_pos + skip + size - self._load(_READ_POS) > self.capacity:
+            return False
+        if skip:
+            struct.pack_into('<I', self.buf, _DATA + offset, _PADDING)
+            offset = 0
+        _RECORD.pack_into(self.buf, _DATA + offset, length, kind, pkt_type, keyframe, pts, dts, *time_base,
+                          dtime, ptime)
+        start = _DATA + offset + _RECORD.size
+        self.buf[start:start + length] = payload
+        self._store(_WRITE_POS, write_pos + skip + size)
+        return True
+
+    def read(self):
+        """Iterate over the available records, each one is released as soon as it is taken"""
+        read_pos = self._load(_READ_POS)
+        write_pos = self._load(_WRITE_POS)
+        time_bases = {}
+        while read_pos < write_pos:
+            offset = read_pos % self.capacity
+            length, kind, pkt_type, keyframe, pts, dts, tb_num, tb_den, dtime, ptime = \
+                _RECORD.unpack_from(self.buf, _DATA + offset) if self.capacity - offset >= _RECORD.size else \
+                (_PADDING, *[0] * 9)
+            if length == _PADDING:
+                read_pos += self.capacity - offset
+                self._store(_READ_POS, read_pos)
+                continue
+            start = _DATA + offset + _RECORD.size
+            payload = bytes(self.buf[start:start + length])
+            read_pos += _align(_RECORD.size + length)
+            self._store(_READ_POS, read_pos)
+            if (tb_num, tb_den) not in time_bases:
+                time_bases[tb_num, tb_den] = Fraction(tb_num, tb_den) if tb_den else None
+            yield Record(kind, _STREAM_TYPES[pkt_type], bool(keyframe), pts, dts, time_bases[tb_num, tb_den],
+                         dtime, ptime, payload)
+
+    def close(self):
+        self.buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+class _RingQueue:
+    """Stands in for the packet queue of `PacketTimeModifier` in the child process"""
+
+    def __init__(self, ring: PacketRing):
+        self.ring = ring
+        self.modifier = None
+        self._parent = os.getppid()
+
+    def qsize(self):  # the buffer lives in the parent, never flushed here
+        return 0
+
+    async def write(self, *args, **kwargs):
+        while not self.ring.write(*args, **kwargs):  # back pressure from the parent
+            if os.getppid() != self._parent:
+                raise SystemExit("the parent process is gone")
+            await asyncio.sleep(0.005)
+        _send(b'')  # wake up the reader
+
+    async def put(self, item):
+        dtime, pkt_type, pkt = item
+        if pkt is self.modifier.first_packet:
+            await self.write(SWITCH, dtime=self.modifier.switch_time, ptime=self.modifier.offset)
+        await self.write(PACKET, _STREAM_TYPES.index(pkt_type), pkt.is_keyframe, pkt.pts, pkt.dts,
+                         (pkt.time_base.numerator, pkt.time_base.denominator), dtime,
+                         float(pkt.pts * pkt.time_base), memoryview(pkt))
+
+
+def _send(message: bytes):
+    sys.stdout.buffer.write(message + b'\n')
+    sys.stdout.buffer.flush()
+
+
+async def _child_demux(file, start, stream_loop, ring):
+    from .player import PacketTimeModifier
+    queue = _RingQueue(ring)
+    modifier = queue.modifier = PacketTimeModifier(queue)
+    first = True
+    resume = None
+    while stream_loop != 0:
+        stream_loop -= 1
+        with av.open(file, metadata_errors='ignore', timeout=(10, 3)) as container:
+            if start:
+                container.seek(int(start * av.time_base))
+            if first:
+                first = False
+                _send(json.dumps({'opened': True}).encode())
+                state = json.loads(sys.stdin.readline())
+                modifier.set_state(state)
+                resume = state.get('resume')
+            else:
+                await queue.write(LOOP)
+            modifier.switch()
+            skip_dts = {}
+            if resume is not None:
+                modifier.keep_offset(resume['offset'], {
+                    t: getattr(container.streams, t)[0].time_base for t in _STREAM_TYPES})
+                skip_dts = resume['dts']
+            for packet in container.demux():
+                if packet.dts is None:
+                    continue
+                if skip_dts and packet.dts <= skip_dts.get(packet.stream.type, packet.dts - 1):
+                    continue
+                await modifier.put(packet)
+        start = 0.
+        resume = None
+
+
+def _child_main(file: str, start: str, stream_loop: str, ring_name: str):
+    """Entry of the child process, the arguments are from the command line"""
+    start, stream_loop = float(start), int(stream_loop)
+    setup_logging(format=f'%(asctime)s [%(levelname).1s] [demux {os.getpid()}] %(message)s')
+    ring = PacketRing(ring_name)
+    try:
+        asyncio.run(_child_demux(file, start, stream_loop, ring))
+    except Exception as e:
+        logging.error(f"demux process failed: {e!r}")
+        _send(json.dumps({'error': repr(e)}).encode())
+        raise SystemExit(1)
+    finally:
+        ring.close()
+
+
+class IsolatedDemuxer:
+    """
+    Demux and rewrite the timestamps of a file in a child process, and receive the packets from a `PacketRing`.
+
+    - The child is a fresh interpreter importing only this package, not the main module of the bot.
+    - The child opens the input and waits for `go` with the state of the `PacketTimeModifier` in this process,
+      so the new timestamps follow the packets already in the buffer.
+    - To resume after a failed child, `go` also carries a `resume` dict with the offset and the raw dts of the
+      last packet of each type received. The new child skips the packets up to them and keeps the offset,
+      so the output goes on with the next packet as if nothing happened.
+    - The child loops the input by itself, a LOOP record is put in the ring at each loop,
+      and a SWITCH record carrying the new offset comes before the first keyframe after each switch.
+    - The child writes a newline to stdout after each record to wake up the reader,
+      and waits when the ring is full, which happens when the player buffer is full.
+    - Only a local path or URL can be passed to the child.
+    """
+    _process: Optional[asyncio.subprocess.Process] = None
+
+    def __init__(self, file: str, start=0., stream_loop=-1, ring_size=16 << 20, open_timeout=30.):
+        self.file = file
+        self.start = start
+        self.stream_loop = stream_loop
+        self.ring_size = ring_size
+        self.open_timeout = open_timeout
+
+    async def __aenter__(self):
+        await self.spawn()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def spawn(self):
+        """Start the child process, which opens the input in the background"""
+        self._ring = PacketRing(capacity=self.ring_size)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.environ.get('PYTHONPATH')])))
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                sys.executable, '-c', 'import sys; from player.isolation import _child_main; _child_main(*sys.argv[1:])',
+                self.file, str(self.start), str(self.stream_loop), self._ring.name,
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=env)
+        except BaseException:
+            self._ring.close()
+            raise
+
+    async def wait_opened(self):
+        async with asyncio.timeout(self.open_timeout):
+            message = await self._receive()
+        if not message.get('opened'):
+            raise ChildProcessError(f"demux process failed to open {self.file}: {message.get('error')}")
+
+    async def _receive(self) -> dict:
+        """Wait for the next message, skipping the wake-ups"""
+        while line := await self._process.stdout.readline():
+            if line.strip():
+                return json.loads(line)
+        return {'error': f"exited with code {await self._process.wait()}"}
+
+    def go(self, state: dict):
+        self._process.stdin.write(json.dumps(state).encode() + b'\n')
+
+    async def records(self):
+        while True:
+            for record in self._ring.read():
+                yield record
+            line = await self._process.stdout.readline()
+            if line.strip():
+                raise ChildProcessError(f"demux process failed: {json.loads(line).get('error')}")
+            if not line:  # the child has exited
+                code = await self._process.wait()
+                for record in self._ring.read():
+                    yield record
+                if code != 0:
+                    raise ChildProcessError(f"demux process exited with code {code}")
+                return
+
+    async def close(self):
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        try:
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    async with asyncio.timeout(1):
+                        await process.wait()
+                except TimeoutError:
+                    logging.warning(f"demux process {process.pid} does not stop, killing")
+                    process.kill()
+                    await process.wait()
+        finally:
+            self._ring.close()
+
@@ -0,0 +1,118 @@
+"""
+Logging without blocking the event loop.
+
+- Records are put into a queue and written by a background thread, so a slow terminal or pipe never stalls
+  the event loop. Tracebacks are formatted in the writer thread as well.
+- Per-packet log sites use `HotLog`, which costs a single level check when it is disabled.
+- The level of a subsystem logger can be raised for a while with `raise_verbosity`.
+"""
+import asyncio
+import atexit
+import copy
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+from typing import Optional, Union
+
+DEFAULT_FORMAT = '%(asctime)s [%(levelname).1s] [%(name)s] %(message)s'
+
+# loggers of the hot paths, named so that their verbosity can be raised separately
+SUBSYSTEMS = ('player.mux', 'player.demux', 'player.danmaku')
+
+_listener: Optional[QueueListener] = None
+_raised: dict[str, tuple[int, asyncio.TimerHandle]] = {}
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # merge the arguments now since they may be modified later, e.g. the timestamps of a packet,
+        # but leave the traceback to the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(level=logging.INFO, format=DEFAULT_FORMAT, stream=None, force=False) -> Optional[QueueListener]:
+    """
+    Replace the handlers of the root logger with a queue, which is written to `stream` (stderr by default).
+    Like `logging.basicConfig`, nothing is done if the root logger already has handlers, unless `force` is set.
+    """
+    global _listener
+    root = logging.getLogger()
+    if root.handlers and not force:
+        return None
+    if _listener is not None:
+        _listener.stop()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(format))
+    log_queue = queue.SimpleQueue()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+        old_handler.close()
+    root.addHandler(_QueueHandler(log_queue))
+    root.setLevel(level)
+    _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()  # write out the remaining records
+
+
+class HotLog:
+    """
+    A log site in a hot path. Guard the call with the object itself so that the arguments are not evaluated
+    when the level is disabled, and use %-style arguments so that the message is only formatted if emitted::
+
+        if mux_trace:
+            mux_trace("mux %s pkt %d", pkt_type, count)
+
+    :param every: emit one of every `every` calls
+    """
+
+    def __init__(self, logger: logging.Logger, level=logging.DEBUG, every=1):
+        self.logger = logger
+        self.level = level
+        self.every = every
+        self._skipped = 0
+
+    def __bool__(self):
+        return self.logger.isEnabledFor(self.level)  # cached by the logger until a level changes
+
+    def __call__(self, msg, *args):
+        if self._skipped + 1 < self.every:
+            self._skipped += 1
+            return
+        self._skipped = 0
+        self.logger.log(self.level, msg, *args, stacklevel=2)
+
+
+def _restore_level(name: str):
+    level, _ = _raised.pop(name)
+    logging.getLogger(name).setLevel(level)
+    logging.info(f"log level of {name} is restored to {logging.getLevelName(level)}")
+
+
+def raise_verbosity(name: str, level: Union[int, str] = logging.DEBUG, duration=60.):
+    """
+    Set the level of the logger `name` for `duration` seconds, a later call replaces the earlier one
+
+    :raise ValueError: if there is no such logger or level
+    """
+    if name not in SUBSYSTEMS and name not in logging.root.manager.loggerDict:
+        raise ValueError(f"unknown logger {name}, the subsystems are {', '.join(SUBSYSTEMS)}")
+    if isinstance(level, str) and not isinstance(level := logging.getLevelName(level.upper()), int):
+        raise ValueError(f"unknown log level {level}")
+    logger = logging.getLogger(name)
+    if name in _raised:
+        original, handle = _raised.pop(name)
+        handle.cancel()
+    else:
+        original = logger.level
+    logger.setLevel(level)
+    _raised[name] = original, asyncio.get_running_loop().call_later(duration, _restore_level, name)
+    logging.info(f"log level of {name} is {logging.getLevelName(level)} for {duration:.0f}s")
@@ -1,18 +1,41 @@
 import asyncio
 from asyncio import PriorityQueue
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
 import logging
 import os
-import traceback
 from typing import Optional, TypedDict, Literal, Callable, Any, Union
 
 import av
 
+from .cache import ClipCache, CachedClip, CachedPacket, cache_key
+from .catalog import MediaInfo
 from .danmaku import Danmaku
-from .utils import video_opener, Progress, iter_to_thread, _run_callback, ThrottledCall
+from .isolation import IsolatedDemuxer, PACKET, SWITCH, LOOP
+from .logs import HotLog
+from .segments import SegmentedSource
+from .shaper import OutputShaper, open_output, close_output, shaped_output
+from .supervisor import Supervisor, RestartPolicy
+from .utils import video_opener, Progress, iter_to_thread, _run_callback, ThrottledCall, StageTimer
 
 AVFloat = TypedDict('AVFloat', {'video': Optional[float], 'audio': Optional[float]})
 AVInt = TypedDict('AVInt', {'video': Optional[int], 'audio': Optional[int]})
 
+# per-packet traces, raise the verbosity of player.mux or player.demux to see them
+_mux_trace = HotLog(logging.getLogger('player.mux'), every=10)
+_demux_trace = HotLog(logging.getLogger('player.demux'), every=10)
+
+
+@asynccontextmanager
+async def _open_input(file, **kwargs):
+    """Open the input and yield the container with an async iterator of (index, packet)"""
+    if isinstance(file, SegmentedSource):
+        async with file.open(metadata_errors=kwargs.get('metadata_errors', 'strict')) as result:
+            yield result
+    else:
+        async with video_opener(file, **kwargs) as input_container:
+            yield input_container, iter_to_thread(enumerate(input_container.demux()))
+
 
 class PacketTimeModifier:
     """
@@ -29,6 +52,9 @@ class PacketTimeModifier:
     _offset_ts: AVInt
     __audio_buffer: list
     switching: asyncio.Event
+    first_packet: Optional[av.Packet]  # the first video keyframe after switching
+    switch_time: Optional[float]  # and its modified dts time
+    switches: deque[tuple[float, float]]  # recent (switch_time, offset), the muxer may lag behind a few switches
 
     def __init__(self, queue):
         self.offset = 0.
@@ -38,6 +64,8 @@ class PacketTimeModifier:
         self._last_ptime = {'video': 0., 'audio': 0.}
         self._last_dtime = {'video': 0., 'audio': 0.}
         self.switching = asyncio.Event()
+        self.first_packet = self.switch_time = None
+        self.switches = deque(maxlen=8)
 
     def switch(self, flush_buffer=False):
         if flush_buffer and (queue_size := self.queue.qsize()) > 2:
@@ -57,6 +85,46 @@ class PacketTimeModifier:
         # Clear the audio_buffer since it is useless if a new switching happens before the first video keyframe comes
         self.__audio_buffer.clear()
         self.switching.clear()
+        self.first_packet = self.switch_time = None
+
+    @property
+    def last_time(self) -> float:
+        """The latest modified dts time put into the queue"""
+        return max(self._last_dtime.values())
+
+    def get_state(self) -> dict:
+        """The last times, for a modifier in another process to continue from"""
+        return {'dtime': dict(self._last_dtime), 'ptime': dict(self._last_ptime)}
+
+    def set_state(self, state: dict):
+        self._last_dtime = dict(state['dtime'])
+        self._last_ptime = dict(state['ptime'])
+
+    def keep_offset(self, offset: float, time_bases: dict):
+        """Go on with `offset` instead of switching, when the same input is opened again where it stopped"""
+        self.offset = offset
+        self._offset_ts = {pkt_type: int(offset / time_base) for pkt_type, time_base in time_bases.items()}
+
+    def mark_switch(self, first_packet: av.Packet, switch_time: float, offset: float):
+        """Record a switch made by a modifier in another process"""
+        self.offset = offset
+        self.first_packet = first_packet
+        self.switch_time = switch_time
+        self.switches.append((switch_time, offset))
+        self.switching.set()
+
+    async def put_modified(self, pkt_type: Literal['video', 'audio'], pkt: av.Packet, dtime: float, ptime: float):
+        """Put a packet whose timestamps are already modified by a modifier in another process"""
+        self._last_dtime[pkt_type] = dtime
+        self._last_ptime[pkt_type] = ptime
+        await self.queue.put((dtime, pkt_type, pkt))
+
+    def offset_at(self, time: float) -> Optional[float]:
+        """The offset of the input which the modified time belongs to"""
+        for switch_time, offset in reversed(self.switches):
+            if switch_time <= time:
+                return offset
+        return None
 
     async def put(self, pkt: av.Packet):
         """
@@ -86,6 +154,9 @@ class PacketTimeModifier:
                 self._offset_ts[pkt_type] = int(self.offset / pkt.time_base)
                 logging.debug(f"old_offset {old_offset:.3f}s, new offset {self.offset:.3f}s, "
                               f"first video packet dt={raw_dt:.3f}s, pt={raw_pt:.3f}s")
+                self.first_packet = pkt
+                self.switch_time = raw_dt + self.offset
+                self.switches.append((self.switch_time, self.offset))
                 self.switching.set()
 
             if pkt_type == 'audio':
@@ -113,35 +184,131 @@ class PacketTimeModifier:
 class Player:
     container: av.container.OutputContainer = None
     streams: Optional[dict]
+    _next_output: Optional[tuple[av.container.OutputContainer, dict, asyncio.Future]] = None
+    _switch_pending = 0  # the old output is expected to break, do not reconnect it
     _buffer: PriorityQueue
-    _demux_task: Optional[asyncio.Task] = None
-    _mux_task: Optional[asyncio.Task] = None
+    _demux_task: Optional[asyncio.Task] = None  # the demuxer being played
+    _pending_demux_task: Optional[asyncio.Task] = None  # the demuxer opening the next input
+    _preload_event: Optional[asyncio.Event] = None  # set to switch to the preloaded input
+    _last_mux_time: Optional[float] = None
+    _closed = False
     _packet_modifier: PacketTimeModifier = None
     _danmaku: Optional[Danmaku]
+    timeline: Optional[StageTimer] = None  # set externally to trace the next switch
+    shaper: Optional[OutputShaper]
+    cache: Optional[ClipCache]
 
-    def __init__(self, flv_url, buffer_size=600):
+    def __init__(self, flv_url, buffer_size=600, *, container=None, shaping: dict = None, isolation: dict = None,
+                 cache: dict = None, shaper: OutputShaper = None):
+        """
+        :param shaping: keyword arguments of `OutputShaper` to limit the output bandwidth, disabled if None
+        :param isolation: keyword arguments of `IsolatedDemuxer` to demux local files and URLs in a child process,
+            disabled if None
+        :param cache: keyword arguments of `ClipCache` to keep the packets of short clips in memory, disabled if None
+        :param shaper: the `OutputShaper` which `container` is opened with, instead of `shaping`
+        """
         self._flv_url = flv_url
-        self._open_container()
+        self.isolation = isolation
+        self.cache = None if cache is None else ClipCache(**cache)
+        self.shaper = shaper if shaper is not None or shaping is None else OutputShaper(**shaping)
+        if container is None:
+            self._open_container()
+        else:
+            self.container = container
+            self.streams = {}
         self._buffer = PriorityQueue(buffer_size)
         self._packet_modifier = PacketTimeModifier(self._buffer)
-        self._mux_task = asyncio.create_task(self._muxer())
         self._danmaku = None
-        asyncio.create_task(self._watchdog())
+        self._demux_count = 0
+        self._supervisor = Supervisor('player')
+        self._supervisor.start('mux', self._muxer, RestartPolicy(max_restarts=3, window=60.),
+                               on_escalate=self._on_muxer_dead)
+
+    @classmethod
+    async def create(cls, flv_url, buffer_size=600, *, shaping: dict = None, **kwargs):
+        """Create a player without blocking the event loop while the output is being connected"""
+        shaper = None if shaping is None else OutputShaper(**shaping)
+        container = await asyncio.to_thread(open_output, flv_url, shaper)
+        return cls(flv_url, buffer_size, container=container, shaper=shaper, **kwargs)
 
     def _open_container(self):
         if self.container is not None:
-            try:
-                self.container.close()
-            except Exception as e:
-                logging.warning(f"Ignoring the exception {repr(e)} during closing the old container.")
-                traceback.print_exc()
-        self.container = av.open(self._flv_url, mode='w', format='flv')
+            self._close_container(self.container)
+        self.container = open_output(self._flv_url, self.shaper)
         self.streams = {}
 
+    @staticmethod
+    def _close_container(container):
+        try:
+            close_output(container)
+        except Exception as e:
+            logging.warning(f"Ignoring the exception {repr(e)} during closing the old container.", exc_info=True)
+
+    @contextmanager
+    def output_switch_pending(self):
+        """
+        Mark that the current output is about to break because of a switch, e.g. while the group call is being
+        recreated and before `switch_output` is called. Inside the block, a failed mux drops the packet
+        instead of reconnecting the old URL, so the muxer is never blocked and the start time is kept.
+        """
+        self._switch_pending += 1
+        try:
+            yield
+        finally:
+            self._switch_pending -= 1
+
+    async def switch_output(self, flv_url, timeout=10., timer: StageTimer = None):
+        """
+        Make-before-break switch to a new output URL.
+        The new container is opened in a thread while the old one keeps muxing,
+        and the muxer swaps them at the next video keyframe. The demuxer and the buffer are not touched.
+        The URL used to reconnect after a failed mux is only replaced once the new container is opened.
+
+        :param flv_url: the new output URL
+        :param timeout: max seconds to wait for the swap
+        :param timer: if given, record the "open output" and "keyframe swap" stages
+        """
+        with self.output_switch_pending():
+            container = await asyncio.to_thread(open_output, flv_url, self.shaper)
+        self._flv_url = flv_url
+        if timer is not None:
+            timer.mark("open output")
+        if not self.streams:  # nothing has been muxed yet, swap now
+            old_container, self.container = self.container, container
+            await asyncio.to_thread(self._close_container, old_container)
+            return
+        streams = {t: container.add_stream_from_template(self.streams[t], True) for t in ['video', 'audio']}
+        swapped = asyncio.get_running_loop().create_future()
+        if self._next_output is not None:  # a newer switch wins
+            old_container, _, old_swapped = self._next_output
+            old_swapped.set_exception(RuntimeError("the output switch is superseded by a newer one"))
+            await asyncio.to_thread(self._close_container, old_container)
+        self._next_output = (container, streams, swapped)
+        try:
+            await asyncio.wait_for(asyncio.shield(swapped), timeout)
+        except TimeoutError:
+            if self._next_output is not None and self._next_output[2] is swapped:
+                self._next_output = None
+                await asyncio.to_thread(self._close_container, container)
+            raise
+        if timer is not None:
+            timer.mark("keyframe swap")
+
+    def _swap_output(self):
+        old_container = self.container
+        self.container, self.streams, swapped = self._next_output
+        self._next_output = None
+        # closing the old one writes the trailer to the network, do not block the muxer
+        asyncio.get_running_loop().run_in_executor(None, self._close_container, old_container)
+        if not swapped.done():
+            swapped.set_result(None)
+        logging.info("output container is switched")
+
     async def _muxer(self):
         _loop = asyncio.get_running_loop()
         _count = 0
         too_slow_caller = ThrottledCall(logging.warning, 0.5)
+        lead = 0. if self.shaper is None else self.shaper.lead  # mux ahead so the shaper can send ahead
         while not self.streams:
             logging.debug('muxer waiting for start')
             await asyncio.sleep(0.1)
@@ -151,11 +318,11 @@ class Player:
             if start_time is None:  # set start_time when the first packet arrives or after restarting
                 start_time = _loop.time() - pkt_time
             wait = start_time + pkt_time - _loop.time()
-            logging.debug(f'mux {pkt_type} pkt {_count}, '
-                          f'play at time {pkt_time:.3f}s, wait for {wait:.3f}s, '
-                          f'{pkt.dts=}, {pkt.pts=}, {pkt.time_base=}')
-            if wait > 0:
-                await asyncio.sleep(wait)
+            if _mux_trace:
+                _mux_trace('mux %s pkt %d, play at time %.3fs, wait for %.3fs, pkt.dts=%s, pkt.pts=%s, '
+                           'pkt.time_base=%s', pkt_type, _count, pkt_time, wait, pkt.dts, pkt.pts, pkt.time_base)
+            if wait > lead:
+                await asyncio.sleep(wait - lead)
             elif wait < -0.1:
                 if wait > -5:
                     too_slow_caller(f"muxing is too slow and out of sync for {-wait:.3f}s, "
@@ -163,10 +330,17 @@ class Player:
                 else:
                     logging.error(f"out of sync for too long ({-wait:.3f}s). resetting the start time.")
                     start_time = None
+            if not self._switch_pending and (output := shaped_output(self.container)) is not None:
+                await output.wait_writable()  # a slow uplink holds back the muxer, as it does without shaping
 
+            self._last_mux_time = pkt_time
             if self._danmaku is not None:
                 self._danmaku.current_time = pkt_time
             _count += 1
+            if self._next_output is not None and pkt_type == 'video' and pkt.is_keyframe:
+                self._swap_output()
+            if self.timeline is not None and pkt is self._packet_modifier.first_packet:
+                self.timeline.mark("first mux")
 
             # Any exception during muxing will be ignored.
             # The exception should be caused by a broken container, so the `self.container` will be reset.
@@ -174,8 +348,10 @@ class Player:
             try:
                 self.container.mux(pkt)
             except Exception:
-                logging.error(f"Get an exception during muxing. Restarting.")
-                traceback.print_exc()
+                if self._next_output is not None or self._switch_pending:  # skip until the new output is swapped in
+                    too_slow_caller(f"muxing to the old output failed during switching, packet dropped")
+                    continue
+                logging.exception(f"Get an exception during muxing. Restarting.")
                 old_streams = self.streams
                 self._open_container()
                 for t in ['video', 'audio']:
@@ -184,17 +360,27 @@ class Player:
                 _count = 0
 
     async def _demuxer(self, input_name, *,
-                       flush_buffer=True, stream_loop=-1, progress_aiter,
-                       start_callback=None, fail_callback=None):
+                       flush_buffer=True, stream_loop=-1, progress_aiter, start=0., media_info=None,
+                       start_callback=None, ready: asyncio.Event = None):
         async def _set_danmaku_start():
             await self._packet_modifier.switching.wait()
-            self._danmaku.start_time = self._packet_modifier.offset
+            # the video starts at the first keyframe muxed, i.e. the keyframe before a seek position
+            modifier = self._packet_modifier
+            self._danmaku.start_position = max(modifier.switch_time - modifier.offset, 0.)
+            self._danmaku.start_time = modifier.offset
+
+        async def _mark_first_keyframe(timeline):
+            await self._packet_modifier.switching.wait()
+            timeline.mark("first keyframe")
 
         def new_video_init(input_container):
             nonlocal started, flush_buffer
             if not started:  # at the first beginning
                 started = True
                 self._packet_modifier.switch(flush_buffer=flush_buffer)
+                if self.timeline is not None:
+                    self.timeline.mark("flush")
+                    _loop.create_task(_mark_first_keyframe(self.timeline))
                 if start_callback is not None:
                     start_callback()
                 progress_aiter.add_message(f"开始播放", final=True)
@@ -233,13 +419,32 @@ class Player:
             while True:
                 i = 0
                 try:
-                    async with video_opener(input_name, metadata_errors='ignore', timeout=(10, 3)) as input_container:
+                    async with _open_input(input_name, metadata_errors='ignore', timeout=(10, 3)) as (
+                            input_container, packets):
+                        if not started and self.timeline is not None:
+                            self.timeline.mark("open")
+                        if start and not isinstance(input_name, SegmentedSource):
+                            await asyncio.to_thread(input_container.seek, int(start * av.time_base))
+                        # record a whole pass without retrying, so the next loop can be replayed from memory
+                        recorder = self.cache.recorder(input_container) if (
+                                self.cache is not None and key is not None and not start and not fail) else None
+                        if ready is not None and not started:
+                            progress_aiter.add_message("已预加载，等待播放", final=True)
+                            await ready.wait()
                         new_video_init(input_container)
-                        async for i, packet in iter_to_thread(enumerate(input_container.demux())):
+                        async for i, packet in packets:
                             packet: av.Packet
                             if packet.dts is not None:
-                                logging.debug(f'put {packet.stream.type} pkt {i}, raw {packet.pts=}, raw {packet.dts=}')
+                                if _demux_trace:
+                                    _demux_trace('put %s pkt %d, raw packet.pts=%s, raw packet.dts=%s',
+                                                 packet.stream.type, i, packet.pts, packet.dts)
+                                if recorder is not None:
+                                    recorder.record(packet)  # copy before the timestamps are modified
+                                    if recorder.size > self.cache.max_clip_bytes:
+                                        recorder = None
                                 await self._packet_modifier.put(packet)
+                    if recorder is not None:
+                        self.cache.put(key, recorder)
                     return  # do NOT retry if finish successfully
                 except av.FFmpegError as e:
                     fail += 1
@@ -250,11 +455,119 @@ class Player:
                     else:
                         raise
 
+        async def demux_isolated():
+            """Return early with the loops left if the first pass is cached, the rest is replayed in this process"""
+            nonlocal stream_loop
+            seek = start
+            resume = None
+            fail = 0
+            recorder = None
+            while True:
+                last_raw_time = None
+                last_dts = {}  # the raw dts and time base of the last packet of each type
+                async with IsolatedDemuxer(input_name, start=seek, stream_loop=stream_loop, **self.isolation) as child:
+                    if not started:
+                        # open the stream templates here while the child is starting
+                        async with video_opener(input_name, metadata_errors='ignore', timeout=(10, 3)) as template:
+                            if self.cache is not None and not seek:
+                                recorder = self.cache.recorder(template)
+                            await child.wait_opened()
+                            if self.timeline is not None:
+                                self.timeline.mark("open")
+                            if ready is not None:
+                                progress_aiter.add_message("已预加载，等待播放", final=True)
+                                await ready.wait()
+                            new_video_init(template)
+                    else:  # resume after the child failed, the child goes on with the same offset
+                        recorder = None
+                        await child.wait_opened()
+                    child.go(dict(self._packet_modifier.get_state(), resume=resume))
+                    switch = None
+                    try:
+                        async for record in child.records():
+                            if record.kind == SWITCH:
+                                switch = record.dtime, record.ptime
+                            elif record.kind == LOOP:
+                                stream_loop -= 1
+                                if recorder is not None:
+                                    self.cache.put(key, recorder)
+                                    recorder = None
+                                    if self.cache.get(key) is not None:
+                                        return
+                                new_video_init(None)
+                            elif record.kind == PACKET:
+                                packet = av.Packet(record.payload)
+                                packet.pts, packet.dts, packet.time_base = record.pts, record.dts, record.time_base
+                                packet.is_keyframe = record.keyframe
+                                packet.stream = self.streams[record.pkt_type]
+                                if switch is not None:
+                                    self._packet_modifier.mark_switch(packet, *switch)
+                                    switch = None
+                                if recorder is not None:
+                                    # the child has shifted the timestamps, cache the raw ones
+                                    ts_offset = int(self._packet_modifier.offset / record.time_base)
+                                    recorder.add(CachedPacket(record.payload, record.pts - ts_offset,
+                                                              record.dts - ts_offset, record.time_base,
+                                                              record.pkt_type, record.keyframe))
+                                    if recorder.size > self.cache.max_clip_bytes:
+                                        recorder = None
+                                if record.pkt_type == 'video':
+                                    last_raw_time = record.ptime - self._packet_modifier.offset
+                                last_dts[record.pkt_type] = record.dts, record.time_base
+                                await self._packet_modifier.put_modified(
+                                    record.pkt_type, packet, record.dtime, record.ptime)
+                        stream_loop = 0
+                        return
+                    except ChildProcessError as e:
+                        fail += 1
+                        if last_raw_time is None or fail > 3:
+                            raise
+                        logging.warning(f"{e}, resuming from {last_raw_time:.3f}s ({fail}) ...")
+                        # the seek lands on the previous keyframe, the child skips the packets already received
+                        seek = last_raw_time
+                        offset = self._packet_modifier.offset
+                        resume = {'offset': offset, 'dts': {
+                            pkt_type: dts - int(offset / time_base) for pkt_type, (dts, time_base) in last_dts.items()
+                        }}
+
+        async def replay_cached(clip: CachedClip):
+            if not started:
+                if self.timeline is not None:
+                    self.timeline.mark("open")
+                if ready is not None:
+                    progress_aiter.add_message("已预加载，等待播放", final=True)
+                    await ready.wait()
+            new_video_init(clip.templates)
+            for packet in clip.replay(self.streams, start):
+                await self._packet_modifier.put(packet)
+
         started = False
+        key = cache_key(input_name)
+        clip = self.cache.get(key) if self.cache is not None else None
         _loop = asyncio.get_running_loop()
+        if media_info is not None:
+            if start and media_info.keyframes:
+                if media_info.duration is not None and start >= media_info.duration:
+                    logging.warning(f"start time {start:.3f}s exceeds the duration {media_info.duration:.3f}s")
+                    start = 0.
+                # a seek lands on the previous keyframe anyway, make the start time exact
+                start = media_info.keyframe_before(start)
+            if self.streams and not media_info.compatible_with(self.streams):
+                logging.info(f"{media_info.name} is predicted to be incompatible with the current output")
+                progress_aiter.add_message("视频格式与当前推流不同，切换时将重新连接推流")
+        if isinstance(input_name, SegmentedSource) and start:
+            input_name.start = start
         try:
             # test file name first
-            if callable(input_name):
+            if clip is not None:
+                exists = True
+            elif isinstance(input_name, SegmentedSource):
+                try:
+                    exists = await input_name.load()
+                except Exception as e:
+                    logging.warning(f"cannot load the playlist {input_name.playlist}: {e!r}")
+                    exists = False
+            elif callable(input_name):
                 try:
                     (await _run_callback(input_name)).close()
                     exists = True
@@ -276,7 +589,12 @@ class Player:
                     exists = True
             else:
                 exists = await asyncio.to_thread(os.path.exists, input_name)
-            if exists:
+            if self.timeline is not None:
+                self.timeline.mark("probe")
+            if clip is not None:
+                progress_aiter.add_message("已找到缓存的视频")
+                logging.debug(f"{input_name} is cached, replaying...")
+            elif exists:
                 progress_aiter.add_message("已找到视频文件，正在打开...")
                 logging.debug(f"{input_name} exists, opening...")
             else:
@@ -286,9 +604,16 @@ class Player:
 
             # open, decode, and push the stream
             stream_loop = int(stream_loop)
+            if clip is None and self.isolation is not None and isinstance(input_name, str):
+                await demux_isolated()
+                start = 0.
             while stream_loop != 0:
                 stream_loop -= 1
-                await demux_with_retry()
+                if self.cache is not None and (clip := self.cache.get(key)) is not None:
+                    await replay_cached(clip)
+                else:
+                    await demux_with_retry()
+                start = 0.  # loop from the beginning
         except asyncio.CancelledError:
             raise
         except Exception:
@@ -297,22 +622,42 @@ class Player:
         finally:
             if not started:
                 progress_aiter.add_message("未播放", final=True)
-                if fail_callback is not None:
-                    fail_callback()
 
-    def play_now(self, file: Union[str, Callable[[], Any]], progress_aiter=None, danmaku=None):
+    def play_now(self, file: Union[str, Callable[[], Any], SegmentedSource], progress_aiter=None, danmaku=None, *,
+                 start=0., media_info: MediaInfo = None, preload=False, on_start: Callable[[], Any] = None):
+        """
+        Switch to a new input as soon as it is opened, keep playing the current one if it fails
+
+        :param start: seek to this time in seconds. The video starts at the keyframe before it.
+        :param media_info: the catalog entry of the input, used to predict compatibility and seek points
+        :param preload: open the input and wait, switch to it immediately by `play_preloaded`.
+            Like any input still opening, it is cancelled by the next `play_now`.
+        :param on_start: called when the switch actually happens, not called if the input fails to open
+        """
         def start_callback():
-            if old_demux_task is not None:
-                old_demux_task.cancel()
+            # the new input is opened, stop the old one. Until now the old one keeps playing,
+            # so an invalid new input does not interrupt the stream.
+            if self._demux_task is not None:
+                self._demux_task.cancel()
+            self._demux_task = task
+            if self._pending_demux_task is task:
+                self._pending_demux_task = self._preload_event = None
             if self._danmaku is not None:
-                self._danmaku.updater.cancel()
+                self._danmaku.close()
+            if preload and danmaku is not None:  # the inactivity timer may have fired while waiting
+                danmaku.restart()
             self._danmaku = danmaku
+            if on_start is not None:
+                on_start()
 
-        def fail_callback():  # continue to demux the old video if the new one is invalid
-            self._demux_task = old_demux_task
+        def on_exit(exited_task):
+            if self._demux_task is exited_task:
+                self._demux_task = None
+            if self._pending_demux_task is exited_task:
+                self._pending_demux_task = self._preload_event = None
 
         # refuse to play if muxer is already dead
-        if self._mux_task is None or self._mux_task.done():
+        if self._supervisor.get('mux') is None:
             raise RuntimeError(f"cannot play since the muxer of the player is dead")
         # expose the TypeError as early as possible
         if not (danmaku is None or isinstance(danmaku, Danmaku)):
@@ -325,47 +670,77 @@ class Player:
         elif not isinstance(progress_aiter, Progress):
             raise TypeError(f"progress_aiter must be a Progress object, not a {type(progress_aiter)}")
 
-        old_demux_task = self._demux_task
-        self._demux_task = asyncio.create_task(self._demuxer(
+        if isinstance(file, str) and file.endswith(('.m3u8', '.m3u')):
+            file = SegmentedSource(file)
+
+        # the latest request wins over the one still opening
+        if self._pending_demux_task is not None:
+            self._pending_demux_task.cancel()
+        self._demux_count += 1
+        ready = asyncio.Event() if preload else None
+        task = self._supervisor.start(f'demux.{self._demux_count}', lambda: self._demuxer(
             file,
             progress_aiter=progress_aiter,
+            start=start,
+            media_info=media_info,
             start_callback=start_callback,
-            fail_callback=fail_callback
-        ))
-
-    async def _watchdog(self):
-        while self._mux_task is not None:  # otherwise self is already closed
-            if self._mux_task.done():
-                try:
-                    await self._mux_task
-                except BaseException:
-                    logging.error("mux task got an exception and is exited")
-                    traceback.print_exc()
-                else:
-                    logging.error("mux task finished unexpectedly")
-                finally:
-                    self.close()
-                return
-            if self._demux_task and self._demux_task.done():
-                try:
-                    await self._demux_task
-                except BaseException:
-                    logging.error("demux task got an exception and is exited")
-                    traceback.print_exc()
-                else:
-                    logging.debug("demux task is finished")
-                finally:
-                    self._demux_task = None  # only report the error once
-            await asyncio.sleep(1)
+            ready=ready,
+        ), on_exit=on_exit)
+        self._pending_demux_task = task
+        self._preload_event = ready
+
+    def play_preloaded(self) -> bool:
+        """Switch to the preloaded input, return False if there is none"""
+        if self._preload_event is None:
+            return False
+        self._preload_event.set()
+        return True
+
+    def buffer_state(self) -> dict:
+        buffered = None
+        if self._last_mux_time is not None:
+            buffered = max(self._packet_modifier.last_time - self._last_mux_time, 0.)
+        return {
+            'packets': self._buffer.qsize(),
+            'capacity': self._buffer.maxsize,
+            'seconds': buffered,
+        }
+
+    def status(self) -> dict:
+        """A snapshot of the player state, cheap enough to poll frequently"""
+        position = None
+        if self._demux_task is not None and self._last_mux_time is not None:
+            if (offset := self._packet_modifier.offset_at(self._last_mux_time)) is not None:
+                position = self._last_mux_time - offset
+        return {
+            'muxer_alive': self._supervisor.get('mux') is not None,
+            'playing': self._demux_task is not None,
+            'opening': self._pending_demux_task is not None and self._preload_event is None,
+            'preload_pending': self._preload_event is not None,
+            'position': position,
+            'output_time': self._last_mux_time,
+            'switching_output': self._next_output is not None or self._switch_pending > 0,
+            'buffer': self.buffer_state(),
+        }
+
+    def _on_muxer_dead(self, exc):
+        logging.error("mux task keeps failing, closing the player")
+        self.close()
 
     def close(self):
+        if self._closed:
+            return
+        self._closed = True
         logging.info('Player is closing')
-        self._mux_task.cancel()
-        self._demux_task.cancel()
-        self._mux_task = self._demux_task = None
+        self._supervisor.cancel_all()
+        self._demux_task = self._pending_demux_task = None
         if self._danmaku is not None:
-            self._danmaku.updater.cancel()
-        self.container.close()
+            self._danmaku.close()
+        if self._next_output is not None:
+            self._next_output[2].cancel()
+            self._close_container(self._next_output[0])
+            self._next_output = None
+        self._close_container(self.container)
 
     def __del__(self):
         self.close()
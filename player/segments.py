@@ -0,0 +1,147 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+import io
+import logging
+import os
+from typing import Optional
+from urllib import request, parse
+
+import av
+
+from .utils import iter_to_thread
+
+
+@dataclass
+class Segment:
+    uri: str
+    start: Optional[float]  # start time in the playlist, None if the durations are unknown
+    duration: Optional[float]
+
+
+def parse_playlist(text: str, base: str) -> list[Segment]:
+    """
+    Parse an m3u8 media playlist, or a plain segment list with one path / URL per line.
+    Relative URIs are resolved against `base`, the location of the playlist.
+    """
+    segments = []
+    duration = None
+    start = 0.
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXTINF:'):
+            duration = float(line[8:].split(',', 1)[0])
+            continue
+        if not line or line.startswith('#'):
+            continue
+        if base.startswith('http'):
+            uri = parse.urljoin(base, line)
+        else:
+            uri = line if line.startswith('http') else os.path.join(os.path.dirname(base), line)
+        segments.append(Segment(uri, start, duration))
+        start = None if start is None or duration is None else start + duration
+        duration = None
+    return segments
+
+
+def _read(uri: str) -> bytes:
+    if uri.startswith('http'):
+        with request.urlopen(parse.quote(uri, safe=':/?&=%'), timeout=10) as f:
+            return f.read()
+    with open(uri, 'rb') as f:
+        return f.read()
+
+
+class SegmentedSource:
+    """
+    Segmented input (HLS-style m3u8 or a plain segment list) played as one continuous stream.
+
+    - The next `prefetch` segments are downloaded in parallel ahead of the demuxer.
+    - Each segment is demuxed from memory, and dropped once it is demuxed.
+    - The segments must be self-contained with continuous timestamps (e.g. MPEG-TS),
+      so the packets can be put into `PacketTimeModifier` as if they were from one file.
+    - `start` seeks to the segment containing this time, it needs the #EXTINF durations.
+    """
+    segments: Optional[list[Segment]]
+
+    def __init__(self, playlist: str, prefetch=3, start=0., retry=3):
+        self.playlist = playlist
+        self.prefetch = max(int(prefetch), 1)
+        self.start = start
+        self.retry = retry
+        self.segments = None
+
+    def __repr__(self):
+        return f"SegmentedSource({self.playlist!r})"
+
+    async def load(self) -> bool:
+        """Fetch and parse the playlist, return whether there is any segment"""
+        text = (await asyncio.to_thread(_read, self.playlist)).decode('utf-8')
+        self.segments = parse_playlist(text, self.playlist)
+        logging.info(f"{len(self.segments)} segments are found in {self.playlist}")
+        return bool(self.segments)
+
+    def _first_index(self) -> int:
+        for i, segment in enumerate(self.segments):
+            if segment.start is None:
+                break
+            if segment.start + segment.duration > self.start:
+                return i
+        if self.start:
+            logging.warning(f"cannot seek to {self.start:.3f}s in {self.playlist}, start from the beginning")
+        return 0
+
+    async def _fetch(self, segment: Segment) -> bytes:
+        for attempt in range(self.retry):
+            try:
+                return await asyncio.to_thread(_read, segment.uri)
+            except OSError as e:
+                if attempt == self.retry - 1:
+                    raise
+                logging.warning(f"cannot fetch segment {segment.uri}: {e!r}, retrying {attempt + 1} ...")
+                await asyncio.sleep(1)
+
+    @asynccontextmanager
+    async def open(self, **kwargs):
+        """
+        Yield the container of the first segment, as the template of the streams,
+        and an async iterator of (index, packet) over all segments
+
+        :param kwargs: passed to `av.open` for each segment
+        """
+        if self.segments is None:
+            await self.load()
+        segments = self.segments[self._first_index():]
+        self.start = 0.  # loop from the beginning
+        fetches: dict[int, asyncio.Task[bytes]] = {}
+
+        def prefetch(first):
+            for i in range(first, min(first + self.prefetch, len(segments))):
+                if i not in fetches:
+                    fetches[i] = asyncio.create_task(self._fetch(segments[i]))
+
+        async def open_segment(i):
+            prefetch(i)
+            data = await fetches.pop(i)  # evict it from the prefetch buffer
+            return await asyncio.to_thread(av.open, io.BytesIO(data), **kwargs)
+
+        async def packets():
+            nonlocal container
+            count = 0
+            for i in range(len(segments)):
+                if i > 0:
+                    await asyncio.to_thread(container.close)
+                    container = await open_segment(i)
+                async for packet in iter_to_thread(container.demux()):
+                    yield count, packet
+                    count += 1
+
+        container = await open_segment(0)
+        packet_iter = packets()
+        try:
+            yield container, packet_iter
+        finally:
+            await packet_iter.aclose()
+            for task in fetches.values():
+                task.cancel()
+            await asyncio.to_thread(container.close)
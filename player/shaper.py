@@ -0,0 +1,202 @@
+import asyncio
+from collections import deque
+import logging
+import threading
+import time
+from typing import Optional
+
+import av
+
+from .utils import ThrottledCall
+
+
+class OutputShaper:
+    """
+    Token bucket shaping for the output of `Player`, configured in kbit/s with a burst allowance in KiB.
+
+    - The bytes themselves are paced, not the packets. The FLV muxer writes into a `ShapedOutput`, which sends
+      the bytes to the network in chunks of `chunk_size` from a thread, each chunk waiting for its tokens.
+      A large keyframe is spread over time instead of being written at once.
+    - The muxer never waits for the shaper, and it writes the packets up to `lead` seconds before they are due.
+      So the bytes of a keyframe start to go out early, and the audio behind it is queued early as well,
+      instead of arriving late at the ingest server on a slow uplink.
+    - The debt is kept in full, so the rate is enforced in the long run. A chunk is not delayed over
+      `max_delay` past its due time (`lead` after it is written), to keep the stream in sync when it is above
+      the rate.
+    - The backlog of an output is bounded: the muxer waits (see `ShapedOutput.wait_writable`) while the oldest
+      queued byte has waited over `lead + max_delay`, so a slow uplink pushes back on the muxer as an unshaped
+      output does. An output whose backlog reaches `stall_timeout` raises on `write`, and the muxer reconnects.
+      The kernel send buffer of a ``tcp://`` output is limited to `send_buffer_kb`, so a slow connection blocks
+      the sending thread, where the delay is measured, instead of hiding seconds of bytes in the kernel.
+      PyAV opens the output without protocol options, so other protocols keep the system default.
+    - The outputs opened by one shaper share the bucket, e.g. the old and the new output while switching.
+
+    The queueing delay of the chunks, from being written to being sent, is accumulated in `stats` and logged
+    periodically. It includes the wait for tokens as well as the time spent behind a slow connection.
+    """
+    rate: float  # bytes per second
+    capacity: float  # bytes
+    stats: dict[str, float]
+
+    def __init__(self, rate_kbps: float, burst_kb: float = 256, max_delay: float = 0.5, lead: float = 0.5,
+                 chunk_size=4096, stall_timeout: float = 5., send_buffer_kb: Optional[float] = 16,
+                 report_interval: float = 60, timer=time.monotonic):
+        if rate_kbps <= 0:
+            raise ValueError("rate_kbps must be positive")
+        self.rate = rate_kbps * 125
+        self.capacity = max(burst_kb, 0) * 1024
+        self.max_delay = max_delay
+        self.lead = max(lead, 0.)
+        self.chunk_size = chunk_size
+        self.max_backlog = self.lead + max(max_delay, 0.)
+        self.stall_timeout = max(stall_timeout, self.max_backlog)
+        self.send_buffer = None if send_buffer_kb is None else int(send_buffer_kb * 1024)
+        self.timer = timer
+        self._tokens = self.capacity
+        self._last_refill = self.timer()
+        self._lock = threading.Lock()  # taken by the sending threads of all outputs
+        self.stats = {'chunks': 0, 'late': 0, 'overdue': 0, 'total_delay': 0., 'max_delay': 0.}
+        self._reporter = ThrottledCall(self._report, report_interval, self.timer)
+
+    def reserve(self, size: int, written_time: float) -> float:
+        """Take the tokens of a chunk written at `written_time`, return how long to wait before sending it"""
+        with self._lock:
+            now = self.timer()
+            self._tokens = min(self._tokens + (now - self._last_refill) * self.rate, self.capacity)
+            self._last_refill = now
+            self._tokens -= size
+            delay = -self._tokens / self.rate
+            if delay > (deadline := self.lead + self.max_delay - (now - written_time)):
+                delay = deadline
+                self.stats['overdue'] += 1
+        return max(delay, 0.)
+
+    def record(self, written_time: float, send_time: float):
+        """Account the queueing delay of a chunk when it is handed to the connection"""
+        delay = send_time - written_time
+        with self._lock:
+            self.stats['chunks'] += 1
+            self.stats['total_delay'] += delay
+            self.stats['max_delay'] = max(self.stats['max_delay'], delay)
+            if delay > self.lead:
+                self.stats['late'] += 1
+            self._reporter()
+
+    def open(self, url: str) -> av.container.OutputContainer:
+        """Open an FLV output container whose bytes are sent to `url` through this shaper"""
+        return av.open(ShapedOutput(url, self), mode='w', format='flv')
+
+    def _report(self):
+        stats = self.stats
+        if stats['chunks']:
+            logging.info(f"output shaping: {stats['chunks']} chunks queued for "
+                         f"mean {stats['total_delay'] / stats['chunks'] * 1000:.1f}ms, "
+                         f"max {stats['max_delay'] * 1000:.1f}ms, {stats['late']} sent after their due time, "
+                         f"{stats['overdue']} sent at the max delay")
+
+
+class ShapedOutput:
+    """
+    A file-like object for the FLV muxer, queueing the bytes and sending them to `url` in a thread.
+    The bytes are passed to FFmpeg by a raw "data" container, so `url` can be any protocol supported by FFmpeg.
+    A sending error, or a backlog over the `stall_timeout` of the shaper, is raised by the next `write`,
+    i.e. by the `mux` of the FLV container.
+    """
+    _error: Optional[Exception] = None
+    _sending: Optional[float] = None  # written time of the chunk being sent
+
+    def __init__(self, url: str, shaper: OutputShaper):
+        self.shaper = shaper
+        if url.startswith('tcp://') and shaper.send_buffer is not None:
+            url += f"{'&' if '?' in url else '?'}send_buffer_size={shaper.send_buffer}"
+        self._raw = av.open(url, mode='w', format='data')
+        self._stream = self._raw.add_data_stream()
+        self._queue = deque()  # (written time, chunk)
+        self._ready = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._send, name='shaped-output', daemon=True)
+        self._thread.start()
+
+    def backlog(self) -> float:
+        """Seconds the oldest byte not sent yet has been waiting"""
+        with self._ready:
+            oldest = self._sending if self._sending is not None else self._queue[0][0] if self._queue else None
+        return 0. if oldest is None else self.shaper.timer() - oldest
+
+    async def wait_writable(self):
+        """Wait until the backlog is within `max_backlog` of the shaper, or so stalled that `write` raises"""
+        shaper = self.shaper
+        interval = max(shaper.chunk_size / shaper.rate, 0.01)
+        while self._error is None and shaper.max_backlog < self.backlog() <= shaper.stall_timeout:
+            await asyncio.sleep(interval)
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        if (backlog := self.backlog()) > self.shaper.stall_timeout:
+            raise TimeoutError(f"the output is stalled, the queued bytes have waited for {backlog:.1f}s")
+        now = self.shaper.timer()
+        size = self.shaper.chunk_size
+        with self._ready:
+            self._queue.extend((now, data[i:i + size]) for i in range(0, len(data), size))
+            self._ready.notify()
+
+    def _send(self):
+        count = 0
+        while True:
+            with self._ready:
+                while not self._queue and not self._closed:
+                    self._ready.wait()
+                if not self._queue:
+                    break
+                written_time, chunk = self._queue.popleft()
+                self._sending = written_time
+            if (delay := self.shaper.reserve(len(chunk), written_time)) > 0:
+                time.sleep(delay)
+            self.shaper.record(written_time, self.shaper.timer())
+            packet = av.Packet(chunk)
+            packet.pts = packet.dts = count
+            packet.stream = self._stream
+            count += 1
+            try:
+                self._raw.mux(packet)
+            except Exception as e:
+                self._error = e
+                with self._ready:
+                    self._queue.clear()
+                break
+            finally:
+                self._sending = None
+        try:
+            self._raw.close()
+        except Exception as e:
+            logging.warning(f"Ignoring the exception {repr(e)} during closing the shaped output.")
+
+    def close(self):
+        """
+        Stop taking bytes and return at once. The thread sends the rest of the queue, which is bounded by the
+        backlog limit, and then closes the connection.
+        """
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+
+
+def open_output(url: str, shaper: OutputShaper = None) -> av.container.OutputContainer:
+    return av.open(url, mode='w', format='flv') if shaper is None else shaper.open(url)
+
+
+def shaped_output(container: av.container.OutputContainer) -> Optional[ShapedOutput]:
+    """The `ShapedOutput` that a container opened by `open_output` writes into, None if it is not shaped"""
+    output = getattr(container.file, 'file', None)
+    return output if isinstance(output, ShapedOutput) else None
+
+
+def close_output(container: av.container.OutputContainer):
+    """Close an output container opened by `open_output`, including the sending thread of a shaped one"""
+    output = shaped_output(container)
+    try:
+        container.close()
+    finally:
+        if output is not None:
+            output.close()
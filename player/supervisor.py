@@ -0,0 +1,101 @@
+import asyncio
+from dataclasses import dataclass
+import logging
+from typing import Callable, Coroutine, Optional, Any
+
+
+@dataclass
+class RestartPolicy:
+    """
+    What to do when a supervised task raises
+
+    :param max_restarts: restarts allowed within `window` seconds, escalate after that. 0 means never restart.
+    :param backoff: delay before the first restart, doubled for each following restart in the window
+    """
+    max_restarts: int = 0
+    window: float = 60.
+    backoff: float = 1.
+    max_backoff: float = 30.
+
+
+NEVER_RESTART = RestartPolicy()
+
+
+class Supervisor:
+    """
+    Event-driven task supervision. Every task gets a done callback, so a failure is handled as soon as
+    the task exits instead of being found by a polling watchdog.
+
+    - Cancellation is never treated as a failure.
+    - A failed task is restarted from its factory according to its `RestartPolicy`.
+    - When the restarts are used up, `on_escalate` is called with the exception.
+    - `on_exit` is called with the task whenever a task exits without being restarted.
+    """
+    _restarts: dict[str, list[float]]
+    _tasks: dict[str, asyncio.Task]
+
+    def __init__(self, name: str):
+        self.name = name
+        self._restarts = {}
+        self._tasks = {}
+
+    def start(self, name: str, factory: Callable[[], Coroutine], policy: RestartPolicy = NEVER_RESTART, *,
+              on_exit: Callable[[asyncio.Task], Any] = None,
+              on_escalate: Callable[[BaseException], Any] = None) -> asyncio.Task:
+        """Start `factory()` as a task named `name`, a running task with the same name is cancelled"""
+        return self._spawn(name, factory(), factory, policy, on_exit, on_escalate)
+
+    def _spawn(self, name, coro, factory, policy, on_exit, on_escalate) -> asyncio.Task:
+        if (old_task := self._tasks.get(name)) is not None:
+            old_task.cancel()
+        task = asyncio.create_task(coro, name=f'{self.name}.{name}')
+        self._tasks[name] = task
+        task.add_done_callback(lambda t: self._on_done(t, name, factory, policy, on_exit, on_escalate))
+        return task
+
+    def _on_done(self, task: asyncio.Task, name, factory, policy: RestartPolicy, on_exit, on_escalate):
+        if self._tasks.get(name) is task:
+            del self._tasks[name]
+        if task.cancelled():
+            logging.debug(f"task {task.get_name()} is cancelled")
+        elif (exc := task.exception()) is None:
+            logging.debug(f"task {task.get_name()} is finished")
+        else:
+            logging.error(f"task {task.get_name()} got an exception: {exc!r}", exc_info=exc)
+            if name not in self._tasks and self._restart(name, factory, policy, on_exit, on_escalate):
+                return
+            if on_escalate is not None:
+                on_escalate(exc)
+        if on_exit is not None:
+            on_exit(task)
+
+    def _restart(self, name, factory, policy: RestartPolicy, on_exit, on_escalate) -> bool:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        history = [t for t in self._restarts.get(name, []) if now - t < policy.window]
+        if len(history) >= policy.max_restarts:
+            self._restarts.pop(name, None)
+            return False
+        self._restarts[name] = [*history, now]
+        delay = min(policy.backoff * 2 ** len(history), policy.max_backoff)
+        logging.warning(f"restarting task {self.name}.{name} in {delay:.1f}s "
+                        f"({len(history) + 1}/{policy.max_restarts} in {policy.window:.0f}s)")
+
+        async def delayed():
+            await asyncio.sleep(delay)
+            return await factory()
+
+        # keep the name reserved during the backoff so that a newer start wins
+        self._spawn(name, delayed(), factory, policy, on_exit, on_escalate)
+        return True
+
+    def get(self, name: str) -> Optional[asyncio.Task]:
+        return self._tasks.get(name)
+
+    def cancel(self, name: str):
+        if (task := self._tasks.get(name)) is not None:
+            task.cancel()
+
+    def cancel_all(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
@@ -1,7 +1,7 @@
 import asyncio
 import time
 from asyncio import Queue
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
 from types import CoroutineType
 from typing import Callable, Any
 
@@ -52,6 +52,39 @@ class ThrottledCall:
             self.last_call_time = this_call_time
 
 
+class StageTimer:
+    """
+    Record the duration of named stages, either with ``with timer.stage(name)`` for a single step
+    or with ``timer.mark(name)`` for the time elapsed since the previous mark
+    """
+    stages: dict[str, float]
+
+    def __init__(self, timer=time.perf_counter, start_time=None):
+        self.timer = timer
+        self.stages = {}
+        self.start_time = self._last_mark = timer() if start_time is None else start_time
+
+    @contextmanager
+    def stage(self, name: str):
+        begin = self.timer()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.timer() - begin
+
+    def mark(self, name: str):
+        now = self.timer()
+        self.stages[name] = now - self._last_mark
+        self._last_mark = now
+
+    @property
+    def total(self) -> float:
+        return self.timer() - self.start_time
+
+    def __str__(self):
+        return ', '.join([*(f'{k} {v:.3f}s' for k, v in self.stages.items()), f'total {self.total:.3f}s'])
+
+
 async def _run_callback(func: Callable[[], Any]):
     result = func()
     if isinstance(result, CoroutineType):
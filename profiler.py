@@ -0,0 +1,186 @@
+"""
+On-demand profiling of the running bot, nothing is installed when it is not active.
+
+- A sampling thread walks `sys._current_frames()`, covering the event loop and the demux / mux worker threads.
+- The asyncio debug mode is switched on during profiling to catch the slow callbacks,
+  which are collected from the `asyncio` logger instead of only being logged.
+- The CPU time of each thread is read from its thread CPU clock.
+"""
+import asyncio
+from collections import Counter
+from dataclasses import dataclass
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+# leaf frames of a thread waiting for work, excluded from the hot function report
+_IDLE_LEAVES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+    ('socket.py', 'readinto'),
+}
+
+# the debug mode of asyncio captures a traceback for each new handle and future,
+# which is the cost of profiling itself
+_OVERHEAD_FRAME = 'extract_stack ('
+
+_active = False
+
+
+@functools.lru_cache(4096)
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(stack: str) -> bool:
+    leaf = stack.rsplit(';', 1)[-1]
+    name, _, location = leaf.partition(' (')
+    return (location.split(':', 1)[0], name) in _IDLE_LEAVES
+
+
+def _thread_cpu_times() -> dict[int, tuple[str, float]]:
+    result = {}
+    for thread in threading.enumerate():
+        try:
+            result[thread.ident] = (thread.name, time.clock_gettime(time.pthread_getcpuclockid(thread.ident)))
+        except (AttributeError, OSError):  # not supported on this platform, or the thread has exited
+            pass
+    return result
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(name='profiler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class _SlowCallbackHandler(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records: list[tuple[float, str]] = []
+
+    def emit(self, record):
+        # asyncio logs "Executing %s took %.3f seconds" in debug mode
+        if record.msg.startswith('Executing') and len(record.args) == 2:
+            handle, duration = record.args
+            self.records.append((duration, repr(handle)[:200]))
+
+
+@dataclass
+class Profile:
+    duration: float
+    interval: float
+    samples: int
+    stacks: Counter  # collapsed stack "thread;outer;...;inner" -> samples
+    slow_callbacks: list[tuple[float, str]]  # (seconds, callback)
+    slow_callback_duration: float
+    cpu: dict[str, float]  # thread name -> CPU seconds
+
+    @property
+    def overhead(self) -> int:
+        """Samples spent in the asyncio debug mode"""
+        return sum(count for stack, count in self.stacks.items() if _OVERHEAD_FRAME in stack)
+
+    def top(self, n=15) -> list[tuple[str, int, int]]:
+        """The hottest functions as (function, self samples, total samples), idle waiting and overhead excluded"""
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            if _is_idle(stack) or _OVERHEAD_FRAME in stack:
+                continue
+            frames = stack.split(';')[1:]
+            self_counts[frames[-1]] += count
+            for frame in set(frames):
+                total_counts[frame] += count
+        return [(f, self_counts[f], c) for f, c in
+                sorted(total_counts.items(), key=lambda i: (self_counts[i[0]], i[1]), reverse=True)[:n]]
+
+    def report(self, top=15, max_callbacks=10) -> str:
+        samples = max(self.samples, 1)
+        lines = [f"profile of {self.duration:.1f}s, {self.samples} samples every {self.interval * 1000:.0f}ms"]
+        if cpu := [(name, t) for name, t in sorted(self.cpu.items(), key=lambda i: i[1], reverse=True) if t >= 0.01]:
+            lines.append("CPU time: " + ", ".join(f"{name} {t:.2f}s ({t / self.duration:.0%})" for name, t in cpu))
+        lines.append(f"top {top} functions (self / total), "
+                     f"excluding {self.overhead / samples:.1%} of asyncio debug overhead:")
+        for function, self_count, total_count in self.top(top):
+            lines.append(f"{self_count / samples:6.1%} {total_count / samples:6.1%}  {function}")
+        lines.append(f"slow callbacks over {self.slow_callback_duration * 1000:.0f}ms: {len(self.slow_callbacks)}")
+        for duration, callback in sorted(self.slow_callbacks, reverse=True)[:max_callbacks]:
+            lines.append(f"{duration * 1000:6.0f}ms  {callback}")
+        return '\n'.join(lines)
+
+    def collapsed(self) -> str:
+        """The raw samples in the collapsed stack format of flamegraph.pl, also accepted by speedscope"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+async def profile(duration: float, interval: float = 0.005, slow_callback_duration: float = 0.05,
+                  loop: Optional[asyncio.AbstractEventLoop] = None) -> Profile:
+    """
+    Profile the whole process for `duration` seconds. Only one profile can run at a time.
+
+    :param interval: sampling interval in seconds
+    :param slow_callback_duration: report the event loop callbacks running longer than this
+    """
+    global _active
+    if _active:
+        raise RuntimeError("another profile is running")
+    _active = True
+    loop = loop or asyncio.get_running_loop()
+    debug, slow_duration = loop.get_debug(), loop.slow_callback_duration
+    asyncio_logger = logging.getLogger('asyncio')
+    handler = _SlowCallbackHandler()
+    sampler = _Sampler(interval)
+
+    asyncio_logger.addHandler(handler)
+    loop.set_debug(True)
+    loop.slow_callback_duration = slow_callback_duration
+    cpu_start = _thread_cpu_times()
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        sampler.stop()
+        elapsed = time.perf_counter() - start
+        cpu_end = _thread_cpu_times()
+        loop.set_debug(debug)
+        loop.slow_callback_duration = slow_duration
+        asyncio_logger.removeHandler(handler)
+        _active = False
+
+    cpu = Counter()
+    for ident, (name, end) in cpu_end.items():
+        cpu[name] += end - cpu_start.get(ident, (name, 0.))[1]
+    logging.info(f"profiled {elapsed:.1f}s with {sampler.samples} samples, "
+                 f"{len(handler.records)} slow callbacks")
+    return Profile(elapsed, interval, sampler.samples, sampler.stacks, handler.records, slow_callback_duration,
+                   dict(cpu))
@@ -1,18 +1,38 @@
+import functools
 import re
 import json
+from typing import Optional
+
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from bot_lib import button_callback_grid
+from player.catalog import Catalog
 
 sel_date_regex = re.compile(r"^SEL(?:_Y_(\d{4})(?:_M_(\d{2})(?:_N_(\d{2}))?)?)?$")
 
-with open('live_info.json', encoding='utf8') as f:
-    live_info = json.load(f)
+
+@functools.cache
+def get_live_info() -> dict:
+    """Load the live index on first use instead of at import time"""
+    with open('live_info.json', encoding='utf8') as f:
+        return json.load(f)
+
+
+catalog: Optional[Catalog] = None  # set externally to show the durations
+
+
+def format_duration(name: str) -> str:
+    info = None if catalog is None else catalog.get(name)
+    if info is None or info.duration is None:
+        return ''
+    minutes, seconds = divmod(int(info.duration), 60)
+    return f' ({minutes // 60}:{minutes % 60:02d}:{seconds:02d})'
 
 
 # TODO: create a specification for status literal
 
 def build_reply(year=None, month=None, num=None):
     result = {'text': None, 'reply_markup': None, 'status': 0}
+    live_info = get_live_info()
     if year is None:
         result['text'] = f"请选择要播放的直播所在年份"
         avail_years = list(live_info)
@@ -43,7 +63,7 @@ def build_reply(year=None, month=None, num=None):
         lives_str = []
         for i, live_i in enumerate(avail_lives):
             num = f'{i + 1:02d}'
-            lives_str.append(num + '. ' + live_i)
+            lives_str.append(num + '. ' + live_i + format_duration(live_i))
             button_text.append(num)
         lives_str = '\n'.join(lives_str)
         result['text'] = f"{year}年{month}月中有{len(avail_lives)}场可回放的直播\n{lives_str}\n请选择直播编号"
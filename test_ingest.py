@@ -0,0 +1,77 @@
+import asyncio
+import argparse
+import logging
+import tempfile
+
+from harness import FlvSink, Impairment, make_clip
+from player import Player
+
+logging.basicConfig(format='%(asctime)s [%(levelname).1s] [%(name)s] %(message)s', level=logging.INFO)
+
+
+def stall_arg(text):
+    start, duration = text.split(':')
+    return float(start), float(duration)
+
+
+async def play(args, clip, shaping):
+    impairment = Impairment(rate_kbps=args.rate, latency=args.latency, stalls=args.stall, drops=args.drop)
+    with FlvSink(impairment=impairment) as sink:
+        isolation = {} if args.isolation else None
+        cache = {} if args.cache else None
+        player = await Player.create(sink.url, shaping=shaping, isolation=isolation, cache=cache)
+        player.play_now(clip)
+        await asyncio.sleep(args.duration)
+        player.close()
+    report = sink.report(jitter_buffer=args.jitter_buffer)
+    print(report)
+    if player.shaper is not None:
+        stats = player.shaper.stats
+        mean = stats['total_delay'] / stats['chunks'] if stats['chunks'] else 0.
+        print(f"shaping: {stats['chunks']} chunks queued for mean {mean * 1000:.1f}ms, "
+              f"max {stats['max_delay'] * 1000:.1f}ms, {stats['late']} sent after their due time, "
+              f"{stats['overdue']} sent at the max delay")
+    return report
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        clip = await asyncio.to_thread(make_clip, f'{tmp_dir}/clip.mp4', args.clip_length,
+                                       gop=args.gop, noise=args.noise)
+        shaping = None if args.shape is None else {
+            'rate_kbps': args.shape, 'burst_kb': args.shape_burst, 'max_delay': args.shape_max_delay,
+            'lead': args.shape_lead}
+        if not args.compare or shaping is None:
+            await play(args, clip, shaping)
+            return
+        reports = {}
+        for name, config in [('unshaped', None), (f'shaped at {args.shape:g} kbit/s', shaping)]:
+            print(f"== {name}")
+            reports[name] = await play(args, clip, config)
+        print(f"{'':24}{'peak kbit/s':>12}{'burstiness':>12}{'underruns':>10}{'of audio':>10}{'late s':>8}")
+        for name, r in reports.items():
+            print(f"{name:24}{r.peak_kbps:12.1f}{r.burstiness:12.2f}{r.underruns:10}{r.audio_underruns:10}"
+                  f"{r.underrun_time:8.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="push a synthetic clip through Player to a local impaired sink")
+    parser.add_argument('-t', '--duration', type=float, default=30, help="seconds to play")
+    parser.add_argument('--clip-length', type=float, default=10, help="seconds of the looping synthetic clip")
+    parser.add_argument('--gop', type=int, default=60, help="keyframe interval in frames")
+    parser.add_argument('--noise', action='store_true', help="use a clip with large keyframes")
+    parser.add_argument('--rate', type=float, help="throughput cap in kbit/s")
+    parser.add_argument('--latency', type=float, default=0., help="one-way latency in seconds")
+    parser.add_argument('--stall', type=stall_arg, action='append', default=[],
+                        help="pause reading, START:DURATION in seconds, repeatable")
+    parser.add_argument('--drop', type=float, action='append', default=[],
+                        help="drop the connection at this time in seconds, repeatable")
+    parser.add_argument('--shape', type=float, help="shape the output of Player to this rate in kbit/s")
+    parser.add_argument('--shape-burst', type=float, default=32, help="burst allowance of shaping in KiB")
+    parser.add_argument('--shape-max-delay', type=float, default=0.5, help="max shaping delay in seconds")
+    parser.add_argument('--shape-lead', type=float, default=0.5, help="seconds to send ahead when shaping")
+    parser.add_argument('--compare', action='store_true', help="play once without and once with --shape")
+    parser.add_argument('--isolation', action='store_true', help="demux in a child process")
+    parser.add_argument('--cache', action='store_true', help="replay the looping clip from memory")
+    parser.add_argument('--jitter-buffer', type=float, default=1., help="playout delay of the simulated viewer")
+    asyncio.run(main(parser.parse_args()))
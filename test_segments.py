@@ -0,0 +1,34 @@
+import asyncio
+import argparse
+import logging
+import tempfile
+
+from harness import FlvSink, StaticServer, make_clip, make_segments
+from player import Player, SegmentedSource
+
+logging.basicConfig(format='%(asctime)s [%(levelname).1s] [%(name)s] %(message)s', level=logging.INFO)
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        clip = await asyncio.to_thread(make_clip, f'{tmp_dir}/clip.mp4', args.clip_length)
+        await asyncio.to_thread(make_segments, clip, tmp_dir, args.segment_time)
+        with StaticServer(tmp_dir, delay=args.delay) as http, FlvSink() as sink:
+            player = await Player.create(sink.url)
+            player.play_now(SegmentedSource(f'{http.url}/index.m3u8', prefetch=args.prefetch, start=args.start))
+            await asyncio.sleep(args.duration)
+            player.close()
+        print(sink.report())
+        for path, start, end in http.requests:
+            print(f"GET {path} {start:.3f}s - {end:.3f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="play a segmented clip from a local HTTP server")
+    parser.add_argument('-t', '--duration', type=float, default=15, help="seconds to play")
+    parser.add_argument('--clip-length', type=float, default=20)
+    parser.add_argument('--segment-time', type=float, default=2)
+    parser.add_argument('--prefetch', type=int, default=3)
+    parser.add_argument('--start', type=float, default=0., help="seek to this time in the playlist")
+    parser.add_argument('--delay', type=float, default=0.3, help="seconds of delay of each HTTP response")
+    asyncio.run(main(parser.parse_args()))
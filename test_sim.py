@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import time
+
+from harness import make_clip
+from harness.sim import SimSink, run, check_continuity, check_av_offset, check_pacing
+from player import Player, Danmaku
+
+logging.basicConfig(format='%(asctime)s [%(levelname).1s] [%(name)s] %(message)s', level=logging.WARNING)
+logging.getLogger('player.danmaku').setLevel(logging.ERROR)  # the skipped rounds after each loop
+
+
+def make_danmaku(path, duration, step=0.5):
+    with open(path, 'w', encoding='utf8') as f:
+        json.dump({'data': [[i * step, 0, 0, '', f"弹幕 {i * step:.1f}"] for i in range(int(duration / step))]}, f)
+    return path
+
+
+def check_danmaku(updates: list[tuple[float, float, str]], max_lag) -> list[str]:
+    """The newest line of each update must not be ahead of the video, nor behind it over `max_lag` seconds"""
+    problems = []
+    for now, position, text in updates:
+        newest = float(text.splitlines()[-1].split()[1])
+        if position is not None and not position - max_lag <= newest <= position + 0.05:
+            problems.append(f"danmaku {newest:.1f}s is shown at {position:.3f}s of the video ({now:.3f}s)")
+    return problems
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        clips = [
+            (await asyncio.to_thread(make_clip, f'{tmp_dir}/{name}.mp4', length, gop=gop),
+             make_danmaku(f'{tmp_dir}/{name}.json', length))
+            for name, length, gop in [('a', args.clip_length, 60), ('b', args.clip_length * 1.5, 45)]
+        ]
+        loop = asyncio.get_running_loop()
+        sink = SimSink()
+        player = await Player.create(sink, cache={} if args.cache else None)
+        updates = []
+        shard_updates = [0] * args.shards
+
+        def update_callback(shard):
+            async def update(text):
+                updates.append((loop.time(), player.status()['position'], text))
+                shard_updates[shard] += 1
+
+            return update
+
+        callbacks = [update_callback(i) for i in range(args.shards)]
+
+        begin = time.perf_counter()
+        for i in range(max(int(args.duration // args.switch_every), 1)):
+            video, danmaku_file = clips[i % 2]
+            player.play_now(video, danmaku=Danmaku(danmaku_file, callbacks, update_interval=args.interval))
+            await asyncio.sleep(min(args.switch_every, args.duration))
+        player.close()
+        elapsed = time.perf_counter() - begin
+
+    print(f"simulated {loop.time():.0f}s in {elapsed:.1f}s, {len(updates)} danmaku updates "
+          f"({', '.join(map(str, shard_updates))} by shard), timeline {sink.digest()}")
+    print(sink.report())
+    failed = False
+    for name, problems in [
+        ("continuity", check_continuity(sink.records, args.max_gap)),
+        ("A/V offset", check_av_offset(sink.records)),
+        ("pacing", check_pacing(sink.records)),
+        ("danmaku sync", check_danmaku(updates, args.interval + 1)),
+    ]:
+        print(f"{name}: {'ok' if not problems else f'{len(problems)} problems'}")
+        for problem in problems[:5]:
+            print(f"  {problem}")
+        failed = failed or bool(problems)
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="play looping clips with danmaku on a virtual clock and check "
+                                                 "the output timeline")
+    parser.add_argument('-t', '--duration', type=float, default=7200, help="virtual seconds to play")
+    parser.add_argument('--clip-length', type=float, default=20, help="seconds of the first clip")
+    parser.add_argument('--switch-every', type=float, default=600, help="switch between the clips every N seconds")
+    parser.add_argument('--interval', type=float, default=3, help="danmaku update interval")
+    parser.add_argument('--shards', type=int, default=1, help="danmaku messages updated in turn")
+    parser.add_argument('--max-gap', type=float, default=0.1, help="max timestamp gap in a stream")
+    parser.add_argument('--cache', action='store_true', help="replay the looping clips from memory")
+    sys.exit(run(main(parser.parse_args())))